@@ -1,14 +1,27 @@
 import os
+import copy
+import functools
+import time
 import numpy as np
-import pandas as pd
 
-from tenpy import run_simulation
+from tenpy import run_simulation, resume_from_checkpoint
+from tenpy.tools import hdf5_io
+from tenpy.tools.misc import find_subclass
 from tenpy.linalg import np_conserved as npc
 from tenpy.networks import site
 from tenpy.networks.site import Site
 from tenpy.networks.mps import InitialStateBuilder
+from tenpy.networks.mpo import MPO
 from tenpy.models.lattice import Lattice
-from tenpy.models.model import CouplingMPOModel
+from tenpy.models.model import Model, CouplingMPOModel
+from tenpy.simulations.ground_state_search import GroundStateSearch
+
+import cache
+import chi_control
+import extrapolation
+import profiler
+import scheduler
+import store
 
 ''' Bosons and spin 1/2 fermions site '''
 class BoseFermiSite(Site):
@@ -40,144 +53,105 @@ class BoseFermiSite(Site):
         JW     | Fermion anti-conmutation      | JWu*JWd
         ----------------------------------------------------
         NbNf   | Interacción local bosón-fermión | Nb*Nf
+
+    Derived operators (NbNb, Nf, NfuNfd, NbNf) are created the first time
+    they are requested by the Hamiltonian or a measurement
+
+    Conserved charges: Nb (only if conserve_Nb), Nfu, Nfd
     """
+
+    # Derived operators in terms of the basic ones
+    derived_ops = {
+        'NbNb':   lambda site: site.get_op('Nb Nb'),
+        'Nf':     lambda site: site.get_op('Nfu') + site.get_op('Nfd'),
+        'NfuNfd': lambda site: site.get_op('Nfu Nfd'),
+        'NbNf':   lambda site: site.get_op('Nb Nf'),
+    }
   
-    def __init__(self, N_B_max=1):      # N_B_max: Maximum number of bosons per site
+    def __init__(self, N_B_max=1, conserve_Nb=True):      # N_B_max: Maximum number of bosons per site
 
         # Dimension
         dim = 4*(N_B_max+1)
 
-        # Local states
-        states = []
-        for ii in range(0, N_B_max+1):
-            states.extend([str(ii)+'00',str(ii)+'01',str(ii)+'10',str(ii)+'11'])
-
-        # Diagonal local matrices
-        Nb_diag  = []
-        NbNb_diag = []
-
-        Nfu_diag = []
-        Nfd_diag = []
-        Nf_diag = []
-        NfuNfd_diag = []
-        JWu_diag = []
-        JWd_diag = []
-        JW_diag = []
-
-        NbNf_diag = []
-
-        for ii in range(0, dim):
-            b = ii//4
-            fu = (ii//2)%2
-            fd = ii%2
-
-            Nb_diag.append(b)
-            NbNb_diag.append(b*b)
-
-            Nfu_diag.append(fu)
-            Nfd_diag.append(fd)
-            Nf_diag.append(fu+fd)
-            NfuNfd_diag.append(fu*fd)
-            JWu_diag.append(1-2*fu)
-            JWd_diag.append(1-2*fd)
-            JW_diag.append((1-2*fu)*(1-2*fd))
-
-            NbNf_diag.append(b*(fu+fd))
-
-        Nb = np.diag(Nb_diag).astype(float)
-        NbNb = np.diag(NbNb_diag).astype(float)
-
-        Nfu = np.diag(Nfu_diag).astype(float)
-        Nfd = np.diag(Nfd_diag).astype(float)
-        Nf = np.diag(Nf_diag).astype(float)
-        NfuNfd = np.diag(NfuNfd_diag).astype(float)
-        JWu = np.diag(JWu_diag).astype(float)
-        JWd = np.diag(JWd_diag).astype(float)
-        JW = np.diag(JW_diag).astype(float)
-
-        NbNf = np.diag(NbNf_diag).astype(float)
-
-        # Non-diagonal local matrices
-        B  = np.zeros((dim, dim), dtype=float)
-        Cu = np.zeros((dim, dim), dtype=float)
-        Cd_noJW = np.zeros((dim, dim), dtype=float)
-
-        for ii in range(0, dim-4):
-          B[ii, ii+4] = np.sqrt(1+ii//4)
-
-        for ii in range(0, dim-2):
-          Cu[ii, ii+2] = (1+ii//2)%2
-
-        for ii in range(0, dim-1):
-          Cd_noJW[ii, ii+1] = (1+ii)%2
-
-        Bt = B.transpose()
-        Cut = Cu.transpose()
-
-        Cd = np.dot(JWu, Cd_noJW)
-        Cdt = Cd.transpose()
-
-        # Set of operators
-        ops = dict(B=B, Bt=Bt,
-                   Nb=Nb, NbNb=NbNb, 
-                   Cu=Cu, Cut=Cut, Cd=Cd, Cdt=Cdt,
-                   Nfu=Nfu, Nfd=Nfd, Nf=Nf, NfuNfd=NfuNfd,
-                   JWu=JWu, JWd=JWd, JW=JW,
-                   NbNf=NbNf)
-
-        # Abelian charges 
-        qnames = []         #Charge name
-        qmod = []           #Charge group ((n=1)->Z, (n>1)->Z_n)
-        charges = []        #Charge definition for local states
-
-        #Boson number
-        qnames.append('Nb')
-        qmod.append(1)
-        charges.append(Nb_diag)
-
-        #Up fermion number
-        qnames.append('Nfu')
-        qmod.append(1)
-        charges.append(Nfu_diag)
-
-        #Down fermion number
-        qnames.append('Nfd') 
-        qmod.append(1)
-        charges.append(Nfd_diag) 
-
-        # Merge charges and define corresponding unsorted leg
-        if len(charges) > 1:
-            new_charges = charges[0]
-            for ii in range(1, len(charges)):
-                new_charges = np.vstack((new_charges, charges[ii]))
-            charges = new_charges.T.tolist()
-        else:
-            charges = charges[0]
-        chinfo = npc.ChargeInfo(qmod, qnames)
-        leg_unsorted = npc.LegCharge.from_qflat(chinfo, charges)
+        # Local states, with index 4*b + 2*fu + fd
+        b = np.arange(dim)//4
+        fu = (np.arange(dim)//2)%2
+        fd = np.arange(dim)%2
+        states = [str(b[ii])+str(fu[ii])+str(fd[ii]) for ii in range(0, dim)]
+
+        # Abelian charges (charge group Z for every charge)
+        qnames = ['Nfu', 'Nfd']
+        charges = [fu, fd]
+        if conserve_Nb:
+            qnames.insert(0, 'Nb')
+            charges.insert(0, b)
+        chinfo = npc.ChargeInfo([1]*len(qnames), qnames)
+        leg_unsorted = npc.LegCharge.from_qflat(chinfo, np.array(charges).T)
 
         # Perform permutation of charges 
         perm_qind, leg = leg_unsorted.sort()
         perm_flat = leg_unsorted.perm_flat_from_perm_qind(perm_qind)
         self.perm = perm_flat
 
-        # Reorganice local states and operators according to the permutation
+        # Diagonal operators, given by their diagonal
+        diag_ops = dict(Nb=b, Nfu=fu, Nfd=fd, JWu=1-2*fu, JWd=1-2*fd, JW=(1-2*fu)*(1-2*fd))
+
+        # Annihilation operators as Kronecker products (boson x up fermion x down fermion)
+        # of the local matrices of bosons (B_b) and a single fermion mode (C_c)
+        B_b = np.diag(np.sqrt(np.arange(1, N_B_max+1)), 1)
+        C_c = np.array([[0., 1.], [0., 0.]])
+        JW_c = np.diag([1., -1.])
+        Id_b = np.eye(N_B_max+1)
+        Id_c = np.eye(2)
+        annihilation_ops = dict(B=np.kron(B_b, np.eye(4)),
+                                Cu=np.kron(Id_b, np.kron(C_c, Id_c)),
+                                Cd=np.kron(Id_b, np.kron(JW_c, C_c)))
+        creation_ops = dict(B='Bt', Cu='Cut', Cd='Cdt')
+
+        # Create site with local states reorganized according to the permutation
         states = [states[i] for i in perm_flat]
-        for opname in ops:
-            ops[opname] = ops[opname][np.ix_(perm_flat, perm_flat)]
-
-        # Create site
-        Site.__init__(self, leg, states, **ops)
+        Site.__init__(self, leg, states, sort_charge=False, 
+                      JW=npc.diag(diag_ops.pop('JW')[perm_flat].astype(float), leg))
+
+        # Add operators reorganized according to the permutation, with creation 
+        # operators as the hermitian conjugate of the annihilation operators
+        for opname in diag_ops:
+            op = npc.diag(diag_ops[opname][perm_flat].astype(float), leg)
+            Site.add_op(self, opname, op, hc=opname)
+        for opname in annihilation_ops:
+            op = npc.Array.from_ndarray(annihilation_ops[opname][np.ix_(perm_flat, perm_flat)], [leg, leg.conj()])
+            Site.add_op(self, opname, op, hc=creation_ops[opname])
+            Site.add_op(self, creation_ops[opname], op.conj().transpose(), hc=opname)
 
         # Define which operators need the anti-conmutation operator
         self.need_JW_string |= set(['Cu', 'Cut', 'Cd', 'Cdt', 'JWu', 'JWd', 'JW'])
 
+    # Create derived operators the first time they are requested
+    def add_derived_ops(self, name):
+        for name2 in name.split():
+            if name2 not in self.opnames and name2 in self.derived_ops:
+                Site.add_op(self, name2, self.derived_ops[name2](self), hc=name2)
+
+    def valid_opname(self, name):
+        self.add_derived_ops(name)
+        return Site.valid_opname(self, name)
+
+    def get_op(self, name):
+        self.add_derived_ops(name)
+        return Site.get_op(self, name)
+
+# Create sites only once for each set of parameters (within a process)
+@functools.lru_cache(maxsize=None)
+def bose_fermi_site(N_B_max=1, conserve_Nb=True):
+    return BoseFermiSite(N_B_max, conserve_Nb)
+
 ''' Initial state constructor '''
 class BoseFermiState(InitialStateBuilder):
 
     """
     Create a product state for a given number of bosons and up/down fermions
-    with the particles distributed along the chain
+    with the particles distributed along the chain (along the unit cell for
+    an infinite MPS, so the numbers are per unit cell)
     """
 
     def filling(self):
@@ -222,6 +196,10 @@ class BoseFermiHubbard(CouplingMPOModel):
 
     H_{BF} = + U_{BF}\sum_{i} n^{B}_{i} n^{F}_{i} 
              + V_{BF}\sum_{\langle i, j \rangle} n^{B}_{i} n^{F}_{j}
+
+    The boson chemical potential term - mu_{B} \sum_{i} n^{B}_{i} fixes the boson
+    density when the boson number is not conserved (conserve_Nb: False).
+    With bc_MPS: infinite the chain is infinite, with a unit cell of L sites
     """
 
     # Define geometry and local hilbert space
@@ -230,8 +208,11 @@ class BoseFermiHubbard(CouplingMPOModel):
         # Lattice parameters
         L = model_params.get('L', 2)                # Lenght of chain
         N_B_max = model_params.get('N_B_max', 1)    # Maximum number of bosons per site
+        conserve_Nb = model_params.get('conserve_Nb', True)    # Conservation of boson number
+        bc_MPS = model_params.get('bc_MPS', 'finite')          # Finite chain or infinite (unit cell of L sites)
 
-        return Lattice([L], unit_cell=[BoseFermiSite(N_B_max)])
+        bc = 'periodic' if bc_MPS == 'infinite' else 'open'
+        return Lattice([L], unit_cell=[bose_fermi_site(N_B_max, conserve_Nb)], bc=bc, bc_MPS=bc_MPS)
 
     # Define hamiltonian
     def init_terms(self, model_params):
@@ -245,6 +226,7 @@ class BoseFermiHubbard(CouplingMPOModel):
         V_BB = model_params.get('V_BB', 0.)
         V_FF = model_params.get('V_FF', 0.)
         V_BF = model_params.get('V_BF', 0.)
+        mu_B = model_params.get('mu_B', 0.)
 
         # Interaction terms
 
@@ -259,61 +241,397 @@ class BoseFermiHubbard(CouplingMPOModel):
         self.add_onsite(U_FF, 0, 'NfuNfd')
         self.add_onsite(U_BF, 0, 'NbNf')
 
+        # Chemical potential
+        self.add_onsite(-mu_B, 0, 'Nb')
+
         # Next-neighbor interactions
         self.add_coupling(V_BB, 0, 'Nb', 0, 'Nb', [1])
         self.add_coupling(V_FF, 0, 'Nf', 0, 'Nf', [1])
         self.add_coupling(V_BF, 0, 'Nb', 0, 'Nf', [1])
 
-# Run Bose-Fermi simulation with given parameters
-def run(sim_parameters):
+''' Ground state search with checkpoints '''
+class BoseFermiSearch(GroundStateSearch):
+
+    """
+    Ground state search that saves checkpoints every save_every_x_seconds
+    seconds or every save_every_x_sweeps sweeps, and keeps the sweep
+    statistics and the wall time of the sweeps done before a checkpoint
+    when the simulation is resumed. The statistics of each sweep are
+    appended to the result store stream_filename as soon as it finishes,
+    with the time of each phase of the bond updates if profile is True.
+    If the algorithm parameters have chi_control, the bond dimension grows
+    with the truncation error (chi_control.ChiController), and if they have
+    extrapolation, the energy is extrapolated in the truncation error at the
+    end of each bond dimension stage (extrapolation.Extrapolator), whose
+    stages are saved with the checkpoints
+    """
+
+    def init_algorithm(self, **kwargs):
+        sweep_stats = self.results.get('sweep_stats', None)
+        profile = self.results.get('profile', None)
+        stages = self.results.get('extrapolation', None)
+        super().init_algorithm(**kwargs)
+
+        # Continue the statistics of the simulation loaded from checkpoint
+        if self.loaded_from_checkpoint and sweep_stats is not None and len(sweep_stats['sweep']) > 0:
+            for key in self.engine.sweep_stats:
+                self.engine.sweep_stats[key][0:0] = list(sweep_stats[key])
+            self.engine.time0 = time.time()-sweep_stats['time'][-1]
+
+        # Time the phases of the bond updates (continuing the profile of the simulation loaded from checkpoint)
+        self.profiler = None
+        if self.options.get('profile', False):
+            if not self.loaded_from_checkpoint:
+                profile = None
+            self.profiler = profiler.Profiler(self.engine, profile)
+
+        # Grow the bond dimension with the truncation error instead of chi_list
+        # (options read without get, which would add them to the parameters)
+        options = self.engine.options
+        if 'chi_control' in options.keys():
+            chi_control.ChiController(self.engine, **options['chi_control'])
+
+        # Extrapolate the energy in the truncation error and stop when it is accurate enough
+        # (continuing the stages of the simulation loaded from checkpoint)
+        self.extrapolator = None
+        if 'extrapolation' in options.keys():
+            if not self.loaded_from_checkpoint:
+                stages = None
+            self.extrapolator = extrapolation.Extrapolator(self.engine, stages=stages, **options['extrapolation'])
+
+        # Start the result store with the statistics of the sweeps already done
+        filepath = self.options.get('stream_filename', None)
+        if filepath is not None:
+            if os.path.exists(filepath):
+                os.remove(filepath)
+            store.append(filepath, 'sweep_stats', sweep_table(self.engine.sweep_stats))
+            self.streamed = {'sweep_stats': len(self.engine.sweep_stats['sweep']), 'profile': 0}
+            self.engine.checkpoint.connect(self.stream_sweep_stats)
+
+    # Append the statistics of the sweeps finished since the last call to the result store
+    # (the rows already streamed are counted, not read back from the store)
+    def stream_sweep_stats(self, alg_engine):
+        tables = {'sweep_stats': sweep_table(alg_engine.sweep_stats)}
+        if self.profiler is not None:
+            tables['profile'] = self.profiler.table()
+
+        for group, table in tables.items():
+            streamed = self.streamed[group]
+            store.append(self.options['stream_filename'], group, {name: table[name][streamed:] for name in table})
+            self.streamed[group] = len(table['Sweep'])
+
+    # Save the profile and the stages of the extrapolation with the results and the
+    # checkpoints, to resume them
+    def prepare_results_for_save(self):
+        results = super().prepare_results_for_save()
+        if getattr(self, 'profiler', None) is not None:
+            results['profile'] = self.profiler.table()
+        if getattr(self, 'extrapolator', None) is not None:
+            results['extrapolation'] = self.extrapolator.table()
+        return results
+
+    def save_at_checkpoint(self, alg_engine):
+        save_every = self.options.get('save_every_x_sweeps', None)
+        if save_every is not None and alg_engine.sweeps % save_every == 0:
+            self.save_results()
+            self._last_save = time.time()
+        else:
+            super().save_at_checkpoint(alg_engine)
+
+# Check if a checkpoint was created with the same parameters of a simulation
+# (default values filled in by tenpy are not compared)
+def same_parameters(checkpoint_parameters, sim_parameters):
+    for key in ['model_params', 'initial_state_params', 'algorithm_params']:
+        old = checkpoint_parameters[key]
+        for name in sim_parameters[key]:
+            if name not in old or old[name] != sim_parameters[key][name]:
+                return False
+    return True
+
+# Models built for the current batch of simulations. Built before the pool of
+# workers is created, they are shared with the workers when these are forked
+models = {}
+
+# Get the model of a simulation, building it only once for each set of model parameters
+def get_model(sim_parameters):
+    key = cache.create_key({'model_class': sim_parameters['model_class'],
+                            'model_params': sim_parameters['model_params']})
+    if key not in models:
+        ModelClass = find_subclass(Model, sim_parameters['model_class'])
+        models[key] = ModelClass(copy.deepcopy(sim_parameters['model_params']))
+    return models[key]
+
+# Build the models of a list of simulations
+def build_models(sim_parameters_list):
+    for sim_parameters in sim_parameters_list:
+        get_model(sim_parameters)
+
+# Add bosons to a converged state, spreading each one uniformly along the chain
+def add_bosons(psi, N, trunc_params):
+
+    # Apply N times the operator sum_i Bt_i and compress the resulting state
+    L = psi.L
+    Bt_sum = MPO.from_wavepacket(psi.sites, np.ones(L)/np.sqrt(L), 'Bt')
+    for ii in range(0, N):
+        Bt_sum.apply(psi, {'compression_method': 'SVD', 'trunc_params': trunc_params})
+        psi.norm = 1.
+
+    return psi
+
+# Get table of sweep statistics with the relative energy change and entropy change
+def sweep_table(sweep_stats):
+    N = np.array(sweep_stats['sweep'], dtype=int)
+    t = np.array(sweep_stats['time'], dtype=float)
+    E = np.array(sweep_stats['E'], dtype=float)
+    S = np.array(sweep_stats['S'], dtype=float)
+    dE = np.concatenate(([np.NaN], -np.diff(E)/np.maximum(np.abs(E[1:]), 1)))[:len(E)]
+    dS = np.concatenate((S[:1], np.abs(np.diff(S))))
+    trunc = np.array(sweep_stats['max_trunc_err'], dtype=float)
+    chi = np.array(sweep_stats['max_chi'], dtype=int)
+    return dict(zip(store.SWEEP_COLUMNS, [N, t, E, dE, S, dS, trunc, chi]))
+
+# Reduced density matrix of a site, from the one-site wave function in canonical form
+def site_rho(psi, i):
+    theta = psi.get_B(i, 'Th')
+    return npc.tensordot(theta, theta.conj(), axes=[['vL', 'vR'], ['vL*', 'vR*']])
+
+# Measure the expectation values of one-site operators in one pass over the MPS:
+#   The reduced density matrix of each site is built once and traced with every operator
+def measure_local(psi, opnames):
+    values = {opname: np.zeros(psi.L) for opname in opnames}
+    for i in range(0, psi.L):
+        rho = site_rho(psi, i)
+        for opname in opnames:
+            op = psi.sites[i].get_op(opname)
+            values[opname][i] = np.real(npc.tensordot(op, rho, axes=[['p', 'p*'], ['p*', 'p']]))
+    return values
+
+# Measure the correlation matrices C[i, j] = <A_i B_j> of pairs of one-site operators
+# (A, B), with Jordan-Wigner strings between fermionic operators:
+#   For each site i and each left operator, the left environment is built once and
+#   moved to the right through the MPS, closing it with every right operator at each j.
+#   The lower triangle comes from the reversed pairs, <A_i B_j> = +-<B_j A_i> (i > j)
+def measure_correlations(psi, pairs):
+    L = psi.L
+    pairs = [tuple(pair) for pair in pairs]
+    directed = sorted(set(pairs) | set((b, a) for a, b in pairs))
+    upper = {pair: np.zeros((L, L), dtype=complex) for pair in directed}
+    C = {pair: np.zeros((L, L), dtype=complex) for pair in pairs}
+
+    # Correlations on the same site
+    for i in range(0, L):
+        rho = site_rho(psi, i)
+        site = psi.sites[i]
+        for a, b in pairs:
+            op = npc.tensordot(site.get_op(a), site.get_op(b), axes=['p*', 'p'])
+            C[(a, b)][i, i] = npc.tensordot(op, rho, axes=[['p', 'p*'], ['p*', 'p']])
+
+    # Correlations with j > i, sharing the environment of each left operator
+    for i in range(0, L-1):
+        site = psi.sites[i]
+        theta = psi.get_B(i, 'Th')
+        for a in sorted(set(a for a, b in directed)):
+            string = site.op_needs_JW(a)
+            op = site.get_op(a)
+            if string:
+                op = npc.tensordot(op, site.get_op('JW'), axes=['p*', 'p'])
+            env = npc.tensordot(op, theta, axes=['p*', 'p'])
+            env = npc.tensordot(env, theta.conj(), axes=[['p', 'vL'], ['p*', 'vL*']])
+            right = [b for c, b in directed if c == a]
+            for j in range(i+1, L):
+                B = psi.get_B(j, 'B')
+                env = npc.tensordot(env, B, axes=['vR', 'vL'])
+                for b in right:
+                    value = npc.tensordot(psi.sites[j].get_op(b), env, axes=['p*', 'p'])
+                    upper[(a, b)][i, j] = npc.tensordot(value, B.conj(), axes=[['p', 'vR*', 'vR'], ['p*', 'vL*', 'vR*']])
+                if string:
+                    env = npc.tensordot(psi.sites[j].get_op('JW'), env, axes=['p*', 'p'])
+                env = npc.tensordot(env, B.conj(), axes=[['p', 'vR*'], ['p*', 'vL*']])
+
+    # Combine upper and lower triangles
+    for a, b in pairs:
+        sign = -1 if psi.sites[0].op_needs_JW(a) and psi.sites[0].op_needs_JW(b) else 1
+        C[(a, b)] += np.triu(upper[(a, b)], 1) + sign*np.triu(upper[(b, a)], 1).T
+    return C
+
+# Fourier transform of a connected correlation matrix (structure factor or
+# momentum distribution): F(k) = 1/L sum_ij exp(ik(i-j)) C[i, j], k = 2 pi m/L
+def fourier(C):
+    return np.real(np.diag(np.fft.fft(np.fft.ifft(C, axis=0), axis=1)))
+
+# Measure local expectation values, correlation matrices and their Fourier transforms
+# (only on finite chains: on an infinite chain they would cover a single unit cell,
+# and the correlation length is measured instead)
+#   measure: {'observables': One-site operators, 'correlations': Pairs of one-site operators}
+def measure_state(psi, measure):
+    observables = measure_local(psi, measure.get('observables', []))
+    correlations = measure.get('correlations', [])
+    if len(correlations) > 0 and psi.finite:
+        local = measure_local(psi, set(opname for pair in correlations for opname in pair))
+        observables['k'] = 2*np.pi*np.arange(0, psi.L)/psi.L
+        for (a, b), C in measure_correlations(psi, correlations).items():
+            connected = C-np.outer(local[a], local[b])
+            observables[a+'_'+b] = np.real_if_close(C)
+            observables[a+'_'+b+'_k'] = fourier(connected)
+    return observables
+
+# Get the entanglement entropy of every bond and the largest Schmidt values of each
+# charge sector of every bond, in one pass over the singular values of the MPS:
+#   The charges of the left leg of site i are the charges of the sites left of bond i.
+#   Bond 0 (left of the unit cell) is a real bond only in an infinite chain
+def entanglement(psi, k):
+    bond, charges, values = [], [], []
+    for i in range(0 if not psi.finite else 1, psi.L):
+        S = psi.get_SL(i)
+        q = psi.get_B(i, 'B').get_leg('vL').to_qflat()
+        sectors, inverse = np.unique(q, axis=0, return_inverse=True)
+        for n in range(0, len(sectors)):
+            S_sector = np.sort(S[inverse.ravel() == n])[::-1][0:k]
+            bond.extend([i]*len(S_sector))
+            charges.extend([sectors[n]]*len(S_sector))
+            values.extend(S_sector)
+    return {'entropy': np.array(psi.entanglement_entropy(), dtype=np.float32),
+            'bond': np.array(bond, dtype=np.int32),
+            'charges': np.array(charges, dtype=np.int32).reshape(-1, psi.chinfo.qnumber),
+            'values': np.array(values, dtype=np.float32)}
+
+# Measure the quantities of an infinite MPS in the thermodynamic limit: correlation
+# length from the transfer matrix (in sites) and densities per site
+def measure_infinite(psi):
+    local = measure_local(psi, ['Nb', 'Nfu', 'Nfd'])
+    return {'correlation_length': psi.correlation_length(),
+            'rho_B': local['Nb'].mean(), 'rho_FU': local['Nfu'].mean(), 'rho_FD': local['Nfd'].mean()}
+
+# Measure the state and save the measurements in the result store, next to the given observables
+def save_measurements(filepath, psi, measure, observables={}):
+    observables = dict(observables)
+    if psi is not None:
+        if measure.get('schmidt_values', None) is not None:
+            store.write(filepath, 'entanglement', entanglement(psi, measure['schmidt_values']), {'charges': psi.chinfo.names})
+        observables.update(measure_state(psi, measure))
+        if not psi.finite:
+            observables.update(measure_infinite(psi))
+    store.write(filepath, 'observables', observables)
+
+# Save results of a simulation in its result store, measuring the state if psi is given
+def save_results(filepath, sim_parameters, sweep_stats, energy, log, psi=None, measure={}, profile=None, extrapolation=None):
+    if os.path.exists(filepath):
+        os.remove(filepath)
+    store.write(filepath, 'sweep_stats', sweep_table(sweep_stats))
+    if profile is not None:
+        store.write(filepath, 'profile', profile)
+    if extrapolation is not None:
+        store.write(filepath, 'extrapolation', {name: extrapolation[name] for name in store.EXTRAPOLATION_COLUMNS},
+                    {'energy': extrapolation['energy'], 'error': extrapolation['error']})
+    store.write_metadata(filepath, sim_parameters, log)
+    if psi is not None and measure.get('save_mps', False):
+        store.write_psi(filepath, psi)
+    save_measurements(filepath, psi, measure, {'energy': energy})
+
+# Run Bose-Fermi simulation with given parameters, starting from psi if given
+def simulate(sim_parameters, psi=None):
 
     # Get filename and foldername
     filename = sim_parameters['filename']
     foldername = sim_parameters['foldername']+'/'
     index = sim_parameters['index']
+    measure = sim_parameters['measure']
+    cache_folder = sim_parameters['cache']
+    cache_key = cache.create_key(sim_parameters)
+    timings = sim_parameters['timings']
     sim_parameters.pop('filename', None)
     sim_parameters.pop('foldername', None)
     sim_parameters.pop('index', None)
-
-    # Run simulation with given parameters
+    sim_parameters.pop('measure', None)
+    sim_parameters.pop('cache', None)
+    sim_parameters.pop('timings', None)
+
+    # Use the model built for the batch and the given state instead of the initial state builder
+    resume_data = {'model': get_model(sim_parameters)}
+    if psi is not None:
+        resume_data['psi'] = psi
+
+    # Resume simulation from a checkpoint with the same parameters, if possible
+    checkpoint = foldername+filename+'.ckpt.h5'
+    checkpoint_results = None
+    if sim_parameters['save_resume_data']:
+        sim_parameters['output_filename'] = checkpoint
+        if os.path.exists(checkpoint):
+            checkpoint_results = hdf5_io.load(checkpoint)
+            if not same_parameters(checkpoint_results['simulation_parameters'], sim_parameters):
+                checkpoint_results = None
+
+    # Run simulation with given parameters, streaming the sweep statistics to the result store
     sim_parameters['log_params']['filename'] = foldername+filename+'.aux'
-    results = run_simulation(**sim_parameters)
-
-    # Save sweep statistics in one file
-    N = results['sweep_stats']['sweep']
-    t = results['sweep_stats']['time']
-    E = results['sweep_stats']['E']
-    S = results['sweep_stats']['S']
-    dE = [np.NaN]
-    dS = [S[0]]
-    for ii in range(1, N[-1]):
-        dE.append(-(E[ii]-E[ii-1])/max(np.abs(E[ii]), 1))
-        dS.append(np.abs(S[ii]-S[ii-1]))
-    out = pd.DataFrame(np.array([N, t, E, dE, S, dS]).T, 
-                       columns=['Sweep', 'Time', 'Energy', 'Energy_error', 'Entropy', 'Entropy_error'])
-    out = out.astype({'Sweep': int})
-    out.to_csv(foldername+filename+'.log', index=False)
-
-    f1 = open(foldername+filename+'.log', 'a+')
-    f2 = open(foldername+filename+'.aux', 'r')
-
-    f1.write('\n\n')
-    f1.write(f2.read())
-
-    f1.close()
-    f2.close()
-
+    sim_parameters['stream_filename'] = foldername+filename+'.h5'
+    if checkpoint_results is not None:
+        results = resume_from_checkpoint(checkpoint_results=checkpoint_results, 
+                                         update_sim_params={'log_params': sim_parameters['log_params']})
+    else:
+        results = run_simulation(simulation_class_kwargs={'resume_data': resume_data}, **sim_parameters)
+
+    # Save time and peak memory of simulation for the scheduler
+    scheduler.save_timing(timings, sim_parameters, results['sweep_stats']['time'][-1], profiler.peak_rss())
+
+    # Save sweep statistics, final observables and metadata in the result store
+    with open(foldername+filename+'.aux', 'r') as f:
+        log = f.read()
     os.remove(foldername+filename+'.aux')
+    if os.path.exists(checkpoint):
+        os.remove(checkpoint)
+    save_results(foldername+filename+'.h5', sim_parameters, results['sweep_stats'], results['energy'], log, 
+                 results['psi'], measure, results.get('profile', None), results.get('extrapolation', None))
+
+    # Save results in the cache
+    data = {'energy': results['energy'],
+            'sweep_stats': results['sweep_stats'],
+            'psi': results['psi'],
+            'log': log,
+            'profile': results.get('profile', None),
+            'extrapolation': results.get('extrapolation', None)}
+    cache.save(cache_folder, cache_key, data)
+
+    return index, results['psi']
+
+# Restore the results of a cached simulation in its folder (None if not cached)
+def restore(sim_parameters):
+
+    data = cache.load(sim_parameters['cache'], cache.create_key(sim_parameters))
+    if data is None:
+        return None
+
+    filepath = sim_parameters['foldername']+'/'+sim_parameters['filename']+'.h5'
+    save_results(filepath, sim_parameters, data['sweep_stats'], data['energy'], data['log'], 
+                 data['psi'], sim_parameters['measure'], data.get('profile', None), data.get('extrapolation', None))
+
+    return sim_parameters['index'], data['psi']
+
+# Run Bose-Fermi simulation with given parameters
+def run(sim_parameters):
+    return simulate(sim_parameters)[0]
+
+# Run a chain of simulations with increasing boson number, seeding each
+# simulation with the ground state of the previous one
+def run_chain(sim_parameters_list):
+
+    indices = []
+    psi = None
+    for sim_parameters in sim_parameters_list:
+        N_B = sim_parameters['initial_state_params']['N_B']
+
+        # Add the missing bosons to the previous ground state
+        if psi is not None:
+            chi_list = sim_parameters['algorithm_params']['chi_list']
+            trunc_params = {'chi_max': chi_list[0], 'svd_min': 1.e-10}
+            psi = add_bosons(psi, N_B-N_B_old, trunc_params)
+
+        # Reuse cached results if the simulation was already done
+        restored = restore(sim_parameters)
+        if restored is not None:
+            index, psi = restored
+        else:
+            index, psi = simulate(sim_parameters, psi)
+        indices.append(index)
+        N_B_old = N_B
 
-    # Save expected values
-    if sim_parameters['save_psi'] == True:
-        Nb = results['psi'].expectation_value(['Nb'])
-        Nf = results['psi'].expectation_value(['Nf'])
-        Nfu = results['psi'].expectation_value(['Nfu'])
-        Nfd = results['psi'].expectation_value(['Nfd'])
-        NfuNfd = results['psi'].expectation_value(['NfuNfd'])
-        ex_val = pd.DataFrame(np.array([range(len(Nb)),Nb, Nf, Nfu, Nfd, NfuNfd]).T, columns=['Site', 'Nb', 'Nf', 'Nfu', 'Nfd', 'NfuNfd'])
-        ex_val = ex_val.astype({'Site': int})
-        ex_val.to_csv(foldername+filename+'.out', index=False)
-
-    return index
+    return indices
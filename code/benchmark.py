@@ -0,0 +1,144 @@
+import os
+import time
+import socket
+import shutil
+import tempfile
+import subprocess
+import yaml
+import numpy as np
+import pandas as pd
+
+from tenpy.algorithms.dmrg import TwoSiteDMRGEngine
+
+import BFModel
+import postproccesing
+import store
+
+# Columns of the benchmarks file
+BENCHMARK_COLUMNS = ['Date', 'Host', 'Commit', 'Benchmark', 'L', 'N_B_max', 'chi', 'Stores', 'Repeats', 'Time']
+
+# Interaction parameters of the benchmarked model
+MODEL_PARAMS = {'t_B': 1., 't_F': 1., 'U_BB': 0., 'U_FF': 4., 'U_BF': 6., 'V_BB': 0., 'V_FF': 0., 'V_BF': 0.}
+
+# Best wall time of a function over a number of repeats
+def best_time(function, repeats):
+    times = []
+    for ii in range(0, repeats):
+        start = time.perf_counter()
+        function()
+        times.append(time.perf_counter()-start)
+    return min(times)
+
+# Get current commit of the repository (None outside of git)
+def current_commit():
+    try:
+        return subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], capture_output=True, text=True, check=True).stdout.strip()
+    except Exception:
+        return None
+
+# Create model and half filled initial state for a benchmark
+def create_model(L, N_B_max):
+    model = BFModel.BoseFermiHubbard(dict(MODEL_PARAMS, L=L, N_B_max=N_B_max))
+    psi = BFModel.BoseFermiState(model.lat, {'method': 'filling', 'N_B': L//2, 'N_FU': L//4, 'N_FD': L//4}).run()
+    return model, psi
+
+# Construction of the site for each maximum number of bosons
+def benchmark_site(parameters):
+    rows = []
+    for N_B_max in parameters['N_B_max_site']:
+        t = best_time(lambda: BFModel.BoseFermiSite(N_B_max), parameters['repeats'])
+        rows.append(['site', None, N_B_max, None, None, t])
+    return rows
+
+# Construction of the model (couplings and MPO) for each chain length
+def benchmark_mpo(parameters):
+    rows = []
+    for L in parameters['L_mpo']:
+        t = best_time(lambda: BFModel.BoseFermiHubbard(dict(MODEL_PARAMS, L=L, N_B_max=1)), parameters['repeats'])
+        rows.append(['mpo', L, 1, None, None, t])
+    return rows
+
+# One two-site DMRG sweep at fixed bond dimension, after warm up sweeps reach it,
+# and one pass of each measurement on the resulting state
+def benchmark_sweep(parameters):
+    rows = []
+    for L in parameters['L_sweep']:
+        for N_B_max in parameters['N_B_max_sweep']:
+            for chi in parameters['chi_sweep']:
+                model, psi = create_model(L, N_B_max)
+                engine = TwoSiteDMRGEngine(psi, model, {'trunc_params': {'chi_max': chi, 'svd_min': 1.e-10}})
+                for ii in range(0, parameters['warm_sweeps']):
+                    engine.sweep()
+                rows.append(['sweep', L, N_B_max, chi, None, best_time(engine.sweep, parameters['repeats'])])
+
+                opnames = ['Nb', 'Nf', 'Nfu', 'Nfd', 'NfuNfd']
+                pairs = [['Nb', 'Nb'], ['Nf', 'Nf'], ['Nb', 'Nf'], ['Bt', 'B'], ['Cut', 'Cu']]
+                t = best_time(lambda: BFModel.measure_local(psi, opnames), parameters['repeats'])
+                rows.append(['measure_local', L, N_B_max, chi, None, t])
+                t = best_time(lambda: BFModel.measure_correlations(psi, pairs), parameters['repeats'])
+                rows.append(['measure_correlations', L, N_B_max, chi, None, t])
+                t = best_time(lambda: BFModel.entanglement(psi, 10), parameters['repeats'])
+                rows.append(['entanglement', L, N_B_max, chi, None, t])
+    return rows
+
+# Write a synthetic result store with random sweep statistics
+def synthetic_store(filepath, L, N_B, rng):
+    sweeps = 10
+    energy = -L+N_B*0.1+rng.normal(0., 1.e-3)
+    store.write(filepath, 'sweep_stats', {'Sweep': np.arange(1, sweeps+1), 'Time': np.cumsum(rng.random(sweeps)),
+                                          'Energy': energy+np.logspace(0, -8, sweeps), 'Energy_error': np.logspace(0, -8, sweeps),
+                                          'Entropy': np.ones(sweeps), 'Entropy_error': np.logspace(0, -6, sweeps),
+                                          'Trunc_error': np.logspace(-6, -10, sweeps), 'Chi': np.full(sweeps, 100)})
+    store.write(filepath, 'metadata', {'log': ''}, dict(MODEL_PARAMS, L=L, N_B_max=1, N_B=N_B, N_FU=L//4, N_FD=L//4))
+    store.write(filepath, 'observables', {'energy': energy})
+
+# Postproccesing of a folder of synthetic result stores: from scratch, and
+# incrementally after one more store is added
+def benchmark_postproccesing(parameters):
+    rng = np.random.default_rng(0)
+    folder = tempfile.mkdtemp()+'/'
+    L = 100
+    stores = parameters['stores']
+    try:
+        for nb in range(0, stores):
+            synthetic_store(folder+'BFModel_L{}_NB{}.h5'.format(L, nb), L, nb, rng)
+        start = time.perf_counter()
+        postproccesing.postproccesing_NB(folder)
+        rows = [['postproccesing_NB', L, 1, None, stores, time.perf_counter()-start]]
+
+        synthetic_store(folder+'BFModel_L{}_NB{}.h5'.format(L, stores), L, stores, rng)
+        start = time.perf_counter()
+        postproccesing.postproccesing_NB(folder, ['BFModel_L{}_NB{}.h5'.format(L, stores)])
+        rows.append(['postproccesing_NB_incremental', L, 1, None, stores+1, time.perf_counter()-start])
+    finally:
+        shutil.rmtree(folder)
+    return rows
+
+# Benchmarks selected by name
+BENCHMARKS = {'site': benchmark_site, 'mpo': benchmark_mpo, 'sweep': benchmark_sweep, 'postproccesing': benchmark_postproccesing}
+
+# Run benchmarks and append the results to the benchmarks file
+def run_benchmarks(parameters):
+    date = time.strftime('%Y-%m-%d %H:%M:%S')
+    host = socket.gethostname()
+    commit = current_commit()
+
+    data = []
+    for name in parameters['benchmarks']:
+        for benchmark, L, N_B_max, chi, stores, t in BENCHMARKS[name](parameters):
+            data.append([date, host, commit, benchmark, L, N_B_max, chi, stores, parameters['repeats'], t])
+            print('{:30} L={} N_B_max={} chi={} stores={}: {:.4f} s'.format(benchmark, L, N_B_max, chi, stores, t))
+    data = pd.DataFrame(data, columns=BENCHMARK_COLUMNS)
+
+    filepath = parameters['output']
+    data.to_csv(filepath, mode='a', header=not os.path.exists(filepath), index=False)
+    return data
+
+
+if __name__ == '__main__':
+
+    # Read parameters of the benchmarks
+    with open('settings/benchmark.yml', 'r') as f:
+        parameters = yaml.safe_load(f)
+
+    run_benchmarks(parameters)
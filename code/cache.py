@@ -0,0 +1,56 @@
+import os
+import json
+import hashlib
+
+from tenpy.tools import hdf5_io
+
+# Parameters that define the result of a simulation
+KEY_PARAMETERS = ['simulation_class',
+                  'model_class', 'model_params',
+                  'initial_state_builder_class', 'initial_state_params',
+                  'algorithm_class', 'algorithm_params']
+
+# Parameters that define the physical system of a simulation (its result store is
+# replaced when the same system is simulated again with other algorithm parameters)
+SYSTEM_PARAMETERS = ['model_class', 'model_params', 'initial_state_params']
+
+# Normalize parameters so equivalent values give the same key (1 == 1.0, {0: 5} == {'0': 5})
+def normalize(value):
+    if isinstance(value, dict):
+        return {str(k): normalize(v) for k, v in value.items()}
+    if isinstance(value, (list, tuple)):
+        return [normalize(v) for v in value]
+    if isinstance(value, bool) or value is None or isinstance(value, str):
+        return value
+    if isinstance(value, (int, float)):
+        return float(value)
+    return str(value)
+
+# Create key for the given simulation parameters (only the given ones, all that define the result by default)
+def create_key(sim_parameters, names=KEY_PARAMETERS):
+    parameters = {name: normalize(sim_parameters.get(name)) for name in names}
+    return hashlib.sha256(json.dumps(parameters, sort_keys=True).encode()).hexdigest()
+
+# Get filename of a cached simulation
+def cache_file(folder, key):
+    return os.path.join(folder, key[0:2], key+'.h5')
+
+# Load cached data of a simulation (None if the simulation is not cached)
+def load(folder, key):
+    if folder is None:
+        return None
+    filepath = cache_file(folder, key)
+    if not os.path.exists(filepath):
+        return None
+    return hdf5_io.load(filepath)
+
+# Save data of a simulation in the cache
+def save(folder, key, data):
+    if folder is None:
+        return
+    filepath = cache_file(folder, key)
+    os.makedirs(os.path.dirname(filepath), exist_ok=True)
+
+    # Write to a temporary file first, so other processes never read a partial file
+    hdf5_io.save(data, filepath+'.'+str(os.getpid())+'.h5')
+    os.replace(filepath+'.'+str(os.getpid())+'.h5', filepath)
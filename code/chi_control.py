@@ -0,0 +1,66 @@
+import logging
+
+logger = logging.getLogger(__name__)
+
+''' Adaptive bond dimension of a DMRG engine '''
+class ChiController:
+
+    """
+    Raises chi_max of a DMRG engine (instance only) when the sweeps at the
+    current bond dimension stall while the truncation error is above the target:
+      trunc_target : Target of the maximum truncation error of a sweep
+      chi_increase : Increase of the bond dimension at each stall
+      chi_max      : Largest bond dimension
+    The energy stalls when its relative change is below max_E_err, and the
+    truncation error when a sweep does not reduce it to half. The engine is not
+    converged while the truncation error is above the target and chi can grow
+    """
+
+    def __init__(self, engine, trunc_target, chi_increase, chi_max):
+        self.engine = engine
+        self.trunc_target = trunc_target
+        self.chi_increase = chi_increase
+        self.chi_max = chi_max
+
+        # Continue with the bond dimension reached before a checkpoint
+        stats = engine.sweep_stats
+        if len(stats['sweep']) > 0:
+            engine.trunc_params['chi_max'] = max(engine.trunc_params['chi_max'], int(stats['max_chi'][-1]))
+        self.stage = len(stats['sweep'])
+
+        # Check the bond dimension before each sweep, if the engine does not stop
+        is_converged = engine.is_converged
+        engine.is_converged = lambda: is_converged() and not self.growing()
+        stopping_criterion = engine.stopping_criterion
+        def stop(**kwargs):
+            if stopping_criterion(**kwargs):
+                return True
+            self.update()
+            return False
+        engine.stopping_criterion = stop
+
+    # Check if the truncation error is above the target and chi can grow (the last
+    # sweep used the whole bond dimension, so a larger one keeps more states)
+    def growing(self):
+        stats = self.engine.sweep_stats
+        chi = self.engine.trunc_params['chi_max']
+        return stats['max_trunc_err'][-1] > self.trunc_target and stats['max_chi'][-1] >= chi and chi < self.chi_max
+
+    # Check if the sweeps at the current bond dimension stopped improving
+    def stalled(self):
+        stats = self.engine.sweep_stats
+        E_err = abs(stats['Delta_E'][-1]/max(stats['E'][-1], 1.))
+        if E_err < self.engine.options.get('max_E_err', 1.e-8, 'real'):
+            return True
+        return len(stats['sweep'])-self.stage >= 2 and stats['max_trunc_err'][-1] > 0.5*stats['max_trunc_err'][-2]
+
+    # Raise the bond dimension of the next sweep if needed
+    def update(self):
+        engine = self.engine
+        if len(engine.sweep_stats['sweep']) == 0 or not (self.growing() and self.stalled()):
+            return
+        chi = min(engine.trunc_params['chi_max']+self.chi_increase, self.chi_max)
+        logger.info('Setting chi_max=%d (truncation error %.2e)', chi, engine.sweep_stats['max_trunc_err'][-1])
+        engine.trunc_params['chi_max'] = chi
+        engine.mixer_activate()
+        self.stage = len(engine.sweep_stats['sweep'])
@@ -0,0 +1,92 @@
+import logging
+import numpy as np
+
+logger = logging.getLogger(__name__)
+
+# Extrapolate the energy to zero truncation error with a linear fit of the energy
+# against the truncation error of the last points (largest bond dimensions). The error
+# is the change of the extrapolation when the point with the smallest bond dimension
+# is dropped. Returns (energy, error), with an infinite error if there are not enough points
+# and no error if the last stage did not truncate
+def extrapolate(trunc_err, energy, points=3):
+    trunc_err = np.asarray(trunc_err, dtype=float)[-points:]
+    energy = np.asarray(energy, dtype=float)[-points:]
+    if len(energy) == 0:
+        return np.NaN, np.inf
+    if trunc_err[-1] == 0.:
+        return energy[-1], 0.
+    if len(energy) < max(3, points) or np.ptp(trunc_err[1:]) == 0.:
+        return energy[-1], np.inf
+
+    E0 = np.polyfit(trunc_err, energy, 1)[1]
+    E0_dropped = np.polyfit(trunc_err[1:], energy[1:], 1)[1]
+    return E0, abs(E0-E0_dropped)
+
+''' Energy extrapolation in the truncation error of a DMRG engine '''
+class Extrapolator:
+
+    """
+    Records the bond dimension, truncation error and energy of the last sweep
+    of each bond dimension stage (of chi_list or of the adaptive bond dimension),
+    extrapolates the energy to zero truncation error and stops the engine
+    (instance only) once the error of the extrapolation is below tol:
+      tol    : Tolerance of the extrapolated energy
+      points : Number of stages in the fit (largest bond dimensions, at least 3: the
+               error drops one of them and a line through two points has none)
+      stages : Table of the stages recorded before a checkpoint (as given by table)
+    The truncation errors are those of the sweeps as they ran, so they include
+    the perturbation of the mixer if it was still active at the end of a stage
+    """
+
+    def __init__(self, engine, tol, points=3, stages=None):
+        if points < 3:
+            raise ValueError('The extrapolation needs at least 3 points, got {}'.format(points))
+        self.engine = engine
+        self.tol = tol
+        self.points = points
+        self.chi = []
+        self.trunc_err = []
+        self.energy = []
+        if stages is not None:
+            self.chi = [int(chi) for chi in stages['Chi']]
+            self.trunc_err = [float(trunc_err) for trunc_err in stages['Trunc_error']]
+            self.energy = [float(energy) for energy in stages['Energy']]
+
+        # Check for the end of a stage before each sweep (after the bond dimension
+        # of the next sweep is decided)
+        stopping_criterion = engine.stopping_criterion
+        def stop(**kwargs):
+            chi = engine.trunc_params.get('chi_max', None)
+            if stopping_criterion(**kwargs):
+                self.record(chi)
+                return True
+            if len(engine.sweep_stats['sweep']) == 0 or self.next_chi() == chi:
+                return False
+            self.record(chi)
+            E0, error = extrapolate(self.trunc_err, self.energy, self.points)
+            logger.info('Extrapolated energy %.12f +- %.2e', E0, error)
+            return error < self.tol and engine.sweeps > engine.options.get('min_sweeps', 1, int)
+        engine.stopping_criterion = stop
+
+    # Bond dimension of the next sweep
+    def next_chi(self):
+        chi = self.engine.trunc_params.get('chi_max', None)
+        if self.engine.chi_list is not None:
+            chi = self.engine.chi_list.get(self.engine.sweeps, chi)
+        return chi
+
+    # Record the last sweep as the end of the stage with the given bond dimension
+    def record(self, chi):
+        stats = self.engine.sweep_stats
+        if len(stats['sweep']) == 0 or (len(self.chi) > 0 and self.chi[-1] == chi):
+            return
+        self.chi.append(chi)
+        self.trunc_err.append(stats['max_trunc_err'][-1])
+        self.energy.append(stats['E'][-1])
+
+    # Recorded stages (one column for each entry of store.EXTRAPOLATION_COLUMNS)
+    # and extrapolated energy with its error
+    def table(self):
+        E0, error = extrapolate(self.trunc_err, self.energy, self.points)
+        return {'Chi': np.array(self.chi, dtype=int), 'Trunc_error': np.array(self.trunc_err, dtype=float),
+                'Energy': np.array(self.energy, dtype=float), 'energy': E0, 'error': error}
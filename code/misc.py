@@ -1,10 +1,14 @@
-import requests
-import yaml
+import math
+from fractions import Fraction
+
+import cache
+import notify
 
 # Create name for given parameters and mode:
 #   None: Filename for simulation
 #   NB: Foldername for NB iteration
 #   L: Foldername for L iteration of NB iterations
+#   MU: Foldername for MU_B iteration without boson number conservation
 def create_name(parameters, mode=None):
 
     # Create start of foldername
@@ -16,6 +20,15 @@ def create_name(parameters, mode=None):
         name = 'BFModel_L_RHOB{:.2f}_RHOFU{:.2f}_RHOFD{:.2f}'.format(parameters['RHO_B'],
                                                                      parameters['RHO_FD'],
                                                                      parameters['RHO_FD'])
+    elif mode == 'MU':
+        name = 'BFModel_L{}_MUB_RHOFU{:.2f}_RHOFD{:.2f}'.format(parameters['L'],
+                                                                parameters['RHO_FU'],
+                                                                parameters['RHO_FD'])
+    elif not parameters.get('CONSERVE_NB', True):
+        name = 'BFModel_L{}_MUB{:.4f}_NFU{}_NFD{}'.format(parameters['L'],
+                                                          parameters['MU_B'],
+                                                          parameters['N_FU'],
+                                                          parameters['N_FD'])
     else:
         name = 'BFModel_L{}_NB{}_NFU{}_NFD{}'.format(parameters['L'],
                                                      parameters['N_B'],
@@ -33,23 +46,38 @@ def create_name(parameters, mode=None):
         if interactions[ii][1] != 0.:
             name += interactions[ii][0]+'{0:.1f}'.format(interactions[ii][1])
 
+    # Mark infinite chains (L is the length of the unit cell)
+    if parameters.get('bc_MPS', 'finite') == 'infinite':
+        name = 'i'+name
+
     return name
 
+# Get the unit cell of an infinite chain commensurate with the given densities:
+# the smallest multiple of their denominators with at least L sites (and two
+# sites, for the two-site DMRG)
+def unit_cell(L, densities, max_denominator=100):
+    cell = 1
+    for density in densities:
+        cell = math.lcm(cell, Fraction(density).limit_denominator(max_denominator).denominator)
+    return cell*max(1, -(-max(L, 2)//cell))
+
 # Set parameters to the correct format
 def read_settings(parameters, foldername, index=0):
 
-    # Configure bond dimension list
+    # Configure bond dimension list (linear), or the start of the bond dimension
+    # grown with the truncation error (adaptive)
     chi_list = {0: parameters['chi_init']}
-    for ii in range(1, parameters['max_sweeps']//parameters['chi_step']+1):
-        chi_list[ii*parameters['chi_step']] = parameters['chi_init'] + ii*parameters['chi_increase']
+    if parameters['chi_mode'] == 'linear':
+        for ii in range(1, parameters['max_sweeps']//parameters['chi_step']+1):
+            chi_list[ii*parameters['chi_step']] = parameters['chi_init'] + ii*parameters['chi_increase']
 
     # Configure correct format
     sim_parameters = {
-        'simulation_class': 'GroundStateSearch',
+        'simulation_class': 'BoseFermiSearch',
 
         'model_class': 'BoseFermiHubbard',
         'model_params': {
-            'bc_MPS': 'finite',
+            'bc_MPS': parameters.get('bc_MPS', 'finite'),
             'N_B_max': parameters['N_B_max'],
 
             'L': parameters['L'],
@@ -82,8 +110,11 @@ def read_settings(parameters, foldername, index=0):
             'mixer': True,
         },
 
-        'save_psi': parameters['save_psi'],
-        'save_resume_data': False,
+        'save_psi': True,
+        'save_resume_data': parameters['checkpoint_time'] is not None or parameters['checkpoint_sweeps'] is not None,
+        'save_every_x_seconds': parameters['checkpoint_time'],
+        'save_every_x_sweeps': parameters['checkpoint_sweeps'],
+        'profile': parameters['profile'],
         'save_stats': True,
         'measure_initial': False,
         'use_default_measurements': False,
@@ -95,30 +126,75 @@ def read_settings(parameters, foldername, index=0):
         },
     }
 
-    # Add filename, foldername and index
-    sim_parameters['filename'] = create_name(parameters)
+    # Grow the bond dimension with the truncation error
+    if parameters['chi_mode'] == 'adaptive':
+        sim_parameters['algorithm_params']['chi_control'] = {'trunc_target': parameters['trunc_target'],
+                                                            'chi_increase': parameters['chi_increase'],
+                                                            'chi_max': parameters['chi_max']}
+
+    # Extrapolate the energy in the truncation error, stopping when it is accurate enough
+    if parameters['extrapolation']:
+        if parameters['extrapolation_points'] < 3:
+            raise ValueError('extrapolation_points must be at least 3, got {}'.format(parameters['extrapolation_points']))
+        sim_parameters['algorithm_params']['extrapolation'] = {'tol': parameters['extrapolation_tol'],
+                                                               'points': parameters['extrapolation_points']}
+
+    # Drop boson number conservation and fix the boson chemical potential instead
+    if not parameters.get('CONSERVE_NB', True):
+        sim_parameters['model_params']['conserve_Nb'] = False
+        sim_parameters['model_params']['mu_B'] = parameters['MU_B']
+
+    # Add filename (with a short key of the system, since the name rounds the couplings
+    # and leaves out some of them), foldername and index
+    sim_parameters['filename'] = create_name(parameters)+'_'+cache.create_key(sim_parameters, cache.SYSTEM_PARAMETERS)[0:8]
     sim_parameters['foldername'] = foldername
     sim_parameters['index'] = index
+    sim_parameters['measure'] = {'save_mps': parameters['save_mps']}
+    if parameters['save_psi']:
+        sim_parameters['measure'].update({'observables': parameters['observables'],
+                                          'correlations': parameters['correlations'],
+                                          'schmidt_values': parameters['schmidt_values']})
+    sim_parameters['cache'] = parameters['cache']
+    sim_parameters['timings'] = parameters['timings']
 
     return sim_parameters
 
-# Send message with telegram bot
+# Split a list of simulations with increasing boson number in consecutive chains
+#   warm_start: True -> Number of chains given by chains
+#   warm_start: False -> One chain for each simulation
+def create_chains(sim_parameters_list, chains, warm_start=True):
+
+    # Bosons are only added to the ground state of a finite chain
+    if len(sim_parameters_list) > 0 and sim_parameters_list[0]['model_params']['bc_MPS'] != 'finite':
+        warm_start = False
+
+    if not warm_start or len(sim_parameters_list) == 0:
+        return [[sim_parameters] for sim_parameters in sim_parameters_list]
+
+    chains = max(1, min(chains, len(sim_parameters_list)))
+    size, rest = divmod(len(sim_parameters_list), chains)
+    chain_list = []
+    start = 0
+    for ii in range(0, chains):
+        end = start + size + (1 if ii < rest else 0)
+        chain_list.append(sim_parameters_list[start:end])
+        start = end
+
+    return chain_list
+
+# Notifiers for each config file
+notifiers = {}
+
+# Send message with telegram bot (or the backend of the config file), without
+# waiting for it: the message is queued and sent by a background notifier
 def send_to_telegram(message, config_file):
 
-    # Get token and chat ID from config file
-    try:
-        with open(config_file, 'r') as file:
-            config = yaml.safe_load(file)
-    except:
-        print('No telegram config file.')
+    # Create notifier from config file the first time
+    if config_file not in notifiers:
+        notifiers[config_file] = notify.create_notifier(config_file)
+        if notifiers[config_file] is None:
+            print('No telegram config file.')
+    if notifiers[config_file] is None:
         return None
 
-    apiToken = config['token']
-    chatID = config['ID']
-    apiURL = f'https://api.telegram.org/bot{apiToken}/sendMessage'
-
-    # Send message to chat
-    try:
-        response = requests.post(apiURL, json={'chat_id': chatID, 'text': message})
-    except Exception as e:
-        print(e)
+    notifiers[config_file].send(message)
@@ -0,0 +1,139 @@
+import time
+import queue
+import inspect
+import atexit
+import threading
+import requests
+import yaml
+
+# Maximum length of a message (telegram limit)
+MAX_LENGTH = 4096
+
+''' Telegram bot backend '''
+class TelegramBackend:
+
+    """
+    Sends messages to a telegram chat:
+      token   : Token of the telegram bot
+      ID      : ID of the user chat
+      timeout : Seconds to wait for the telegram API
+    """
+
+    def __init__(self, token, ID, timeout=10.):
+        self.url = f'https://api.telegram.org/bot{token}/sendMessage'
+        self.chat_id = ID
+        self.timeout = timeout
+
+    def send(self, message):
+        requests.post(self.url, json={'chat_id': self.chat_id, 'text': message}, timeout=self.timeout)
+
+''' HTTP backend (local stub server for tests) '''
+class HTTPBackend:
+
+    """
+    Posts messages as json {'text': message} to an url:
+      url     : Url of the endpoint
+      timeout : Seconds to wait for the endpoint
+    """
+
+    def __init__(self, url, timeout=10.):
+        self.url = url
+        self.timeout = timeout
+
+    def send(self, message):
+        requests.post(self.url, json={'text': message}, timeout=self.timeout)
+
+''' File backend (tests without network) '''
+class FileBackend:
+
+    """
+    Appends messages to a file, separated by blank lines:
+      path : File for the messages
+    """
+
+    def __init__(self, path):
+        self.path = path
+
+    def send(self, message):
+        with open(self.path, 'a') as f:
+            f.write(message+'\n\n')
+
+# Backends selected by the 'backend' entry of the config file (default telegram)
+BACKENDS = {'telegram': TelegramBackend, 'http': HTTPBackend, 'file': FileBackend}
+
+''' Background notifier '''
+class Notifier:
+
+    """
+    Sends messages from a background thread, so the caller never waits for
+    the backend. Messages queued while waiting are coalesced into one, and
+    two messages are sent at least min_interval seconds apart
+    """
+
+    def __init__(self, backend, min_interval=3.):
+        self.backend = backend
+        self.min_interval = min_interval
+        self.queue = queue.Queue()
+        self.thread = threading.Thread(target=self.run, daemon=True)
+        self.thread.start()
+
+    # Queue message without blocking
+    def send(self, message):
+        self.queue.put(message)
+
+    # Send queued messages until a None is queued
+    def run(self):
+        last = 0.
+        closed = False
+        while not closed:
+            messages = [self.queue.get()]
+            if messages[0] is None:
+                return
+
+            # Wait for the rate limit and collect the messages queued meanwhile
+            time.sleep(max(0., last+self.min_interval-time.time()))
+            while not self.queue.empty():
+                messages.append(self.queue.get())
+            if None in messages:
+                messages = [message for message in messages if message is not None]
+                closed = True
+            if len(messages) == 0:
+                return
+
+            message = '\n\n'.join(messages)
+            if len(message) > MAX_LENGTH:
+                message = '...'+message[len(message)-MAX_LENGTH+3:]
+            try:
+                self.backend.send(message)
+            except Exception as e:
+                print(e)
+            last = time.time()
+
+    # Send the queued messages and stop the thread (waiting at most timeout seconds)
+    def close(self, timeout=30.):
+        self.queue.put(None)
+        self.thread.join(timeout)
+
+# Create notifier from config file (None if there is no config file or it is not valid):
+#   Each backend only takes the entries of the config file in its signature, so the
+#   entries of the other backends can be left in the file
+def create_notifier(config_file):
+    try:
+        with open(config_file, 'r') as file:
+            config = yaml.safe_load(file)
+    except:
+        return None
+
+    try:
+        config = dict(config)
+        backend = BACKENDS[config.pop('backend', 'telegram')]
+        min_interval = config.pop('min_interval', 3.)
+        arguments = inspect.signature(backend.__init__).parameters
+        backend = backend(**{key: value for key, value in config.items() if key in arguments})
+    except Exception as e:
+        print('Invalid notifier config {}: {!r}'.format(config_file, e))
+        return None
+
+    notifier = Notifier(backend, min_interval)
+    atexit.register(notifier.close)
+    return notifier
@@ -0,0 +1,110 @@
+import os
+import queue
+import multiprocessing
+import numpy as np
+from threadpoolctl import threadpool_limits
+
+# Size of the matrices (local dimension times bond dimension) that one BLAS thread handles efficiently
+BLOCK_SIZE = 1000
+
+# Limit BLAS/OpenMP threads of the current process
+def set_threads(threads):
+    for name in ['OMP_NUM_THREADS', 'OPENBLAS_NUM_THREADS', 'MKL_NUM_THREADS']:
+        os.environ[name] = str(threads)
+    threadpool_limits(limits=threads)
+
+# Number of states of n sites for each total number of particles (index), with at most n_max per site
+def sector_dimensions(n, n_max):
+    dimensions = np.ones(1)
+    for ii in range(0, n):
+        dimensions = np.convolve(dimensions, np.ones(n_max+1))
+    return dimensions
+
+# Largest Schmidt rank of a finite chain: on the central bond, the sum over the charge
+# sectors of the smaller dimension of the two halves (the boson number is left free if
+# it is not conserved)
+def half_chain_dimension(model_params, initial_state_params):
+    L = model_params['L']
+    conserved = [(model_params['N_B_max'], initial_state_params['N_B'], model_params.get('conserve_Nb', True)),
+                 (1, initial_state_params['N_FU'], True),
+                 (1, initial_state_params['N_FD'], True)]
+    sectors = [(1., 1.)]
+    for n_max, n, conserve in conserved:
+        left, right = sector_dimensions(L//2, n_max), sector_dimensions(L-L//2, n_max)
+        if conserve:
+            pairs = [(left[ii], right[n-ii]) for ii in range(0, len(left)) if 0 <= n-ii < len(right)]
+        else:
+            pairs = [(left.sum(), right.sum())]
+        sectors = [(a*c, b*e) for a, b in sectors for c, e in pairs]
+    return sum(min(a, b) for a, b in sectors)
+
+# Largest bond dimension a simulation can reach: the largest of the schedule (or of the
+# adaptive bond dimension), limited by the Schmidt rank of the half chain if it is finite
+def bond_dimension(sim_parameters):
+    algorithm_params = sim_parameters['algorithm_params']
+    chi = max(algorithm_params['chi_list'].values())
+    if 'chi_control' in algorithm_params:
+        chi = max(chi, algorithm_params['chi_control']['chi_max'])
+    model_params = sim_parameters['model_params']
+    if model_params.get('bc_MPS', 'finite') == 'finite':
+        chi = min(chi, half_chain_dimension(model_params, sim_parameters['initial_state_params']))
+    return int(chi)
+
+# Number of threads for a chain of simulations (power of two):
+#   Contractions in the two-site DMRG scale with threads only for large d*chi,
+#   with chi the largest bond dimension the chain can reach
+def chain_threads(chain, max_threads):
+    d = 4*(chain[0]['model_params']['N_B_max']+1)
+    chi = max(bond_dimension(sim_parameters) for sim_parameters in chain)
+    threads = 1
+    while 2*threads <= max_threads and 2*threads*BLOCK_SIZE <= d*chi:
+        threads *= 2
+    return threads
+
+# Run a chain of simulations with the given number of BLAS threads
+def run_threads(function, chain, threads):
+    set_threads(threads)
+    return function(chain)
+
+# Run chains of simulations in a pool of workers, each chain with its own number of
+# BLAS threads, returning the results as soon as they are available (like
+# Pool.imap_unordered). Chains are sent in the given order while the threads of the
+# running chains fit in the cores, so cores freed by any chain are reused:
+#   If a memory budget is given (same units as memories, the predicted peak memory of
+#   each chain), the predicted memory of the running chains must fit in it too.
+#   A chain larger than the cores or the budget runs alone
+def imap_hybrid(function, chain_list, cores, max_threads, memories=None, budget=None):
+    if len(chain_list) == 0:
+        return
+    threads_list = [chain_threads(chain, max_threads) for chain in chain_list]
+    if memories is None or budget is None:
+        memories, budget = [0.]*len(chain_list), float('inf')
+
+    # Send the waiting chains in the given order while they fit in the cores and the budget
+    results = queue.Queue()
+    pool = multiprocessing.Pool(processes=max(1, cores))
+    waiting = list(range(0, len(chain_list)))
+    running = []
+    def fits(ii):
+        threads = sum(threads_list[jj] for jj in running)+threads_list[ii]
+        memory = sum(memories[jj] for jj in running)+memories[ii]
+        return len(running) == 0 or (threads <= cores and memory <= budget)
+    def admit():
+        while len(waiting) > 0 and fits(waiting[0]):
+            ii = waiting.pop(0)
+            running.append(ii)
+            callback = lambda result, ii=ii: results.put((ii, result))
+            pool.apply_async(run_threads, (function, chain_list[ii], threads_list[ii]), callback=callback, error_callback=callback)
+
+    admit()
+    for jj in range(0, len(chain_list)):
+        ii, result = results.get()
+        if isinstance(result, BaseException):
+            pool.terminate()
+            raise result
+        running.remove(ii)
+        admit()
+        yield result
+
+    pool.close()
+    pool.join()
@@ -1,59 +1,295 @@
 import sys
 import os
+import re
+import multiprocessing
+import yaml
 import numpy as np
 import pandas as pd
 
-# Read last line from log files
+import BFModel
+import parallel
+import profiler
+import store
+
+# Read last sweep statistics from result store
 def read_last(filepath):
+    return list(store.read_sweep_stats(filepath).iloc[-1])
+
+# Read last sweep statistics from a legacy log file (written before the result stores:
+# sweep statistics as csv, a blank line and the tenpy log), without the missing columns
+def read_last_log(filepath):
     file = open(filepath, "r")
     N = -1
     for line in file.readlines():
         if line in ['\n', '\r\n']:
             break
         N +=1
+    file.close()
     return list(pd.read_csv(filepath, sep=',', nrows=N).iloc[-1])
 
+# Parameters of a simulation in the manifest of a folder and in the global index
+PARAMETER_COLUMNS = ['L', 'bc_MPS', 'N_B_max', 'N_B', 'N_FU', 'N_FD', 't_B', 't_F', 'U_BB', 'U_FF', 'U_BF', 'V_BB', 'V_FF', 'V_BF', 'mu_B']
+
+# Columns of the manifest of a folder
+MANIFEST_COLUMNS = ['File', 'Modified'] + PARAMETER_COLUMNS + ['Nb', 'Sweeps'] + store.SWEEP_COLUMNS[1:] + ['Energy_extrap', 'Energy_extrap_error', 'Correlation_length']
+
+# Read one row of the manifest from a result store
+def manifest_row(folder, filename):
+    attrs = store.read_attrs(folder+filename, 'metadata')
+    observables = store.read(folder+filename, 'observables')
+    nb = observables['Nb'].sum() if 'Nb' in observables else np.NaN
+    extrapolation = store.read_attrs(folder+filename, 'extrapolation')
+    return [filename, os.path.getmtime(folder+filename)] + [attrs.get(name, np.NaN) for name in PARAMETER_COLUMNS] + [nb] + read_last(folder+filename) \
+           + [extrapolation.get('energy', np.NaN), extrapolation.get('error', np.NaN), observables.get('correlation_length', np.NaN)]
+
+# Parameters written in the names of the legacy log files (interactions equal to zero are not written)
+LEGACY_NAMES = {'L': 'L', 'NB': 'N_B', 'MUB': 'mu_B', 'NFU': 'N_FU', 'NFD': 'N_FD', 'UBB': 'U_BB', 'UFF': 'U_FF',
+                'UBF': 'U_BF', 'VBB': 'V_BB', 'VFF': 'V_FF', 'VBF': 'V_BF'}
+
+# Read one row of the manifest from a legacy log file: parameters from its name, boson
+# number from its .out file (if measured) and NaN for what the log files did not save
+def legacy_manifest_row(folder, filename):
+    parameters = {'bc_MPS': 'finite', 'U_BB': 0., 'U_FF': 0., 'U_BF': 0., 'V_BB': 0., 'V_FF': 0., 'V_BF': 0.}
+    for token in filename[:-4].split('_'):
+        match = re.fullmatch('([A-Z]+)(-?[0-9.]+)', token)
+        if match is not None and match.group(1) in LEGACY_NAMES:
+            value = match.group(2)
+            parameters[LEGACY_NAMES[match.group(1)]] = float(value) if '.' in value else int(value)
+    nb = np.NaN
+    if os.path.exists(folder+filename[:-4]+'.out'):
+        nb = pd.read_csv(folder+filename[:-4]+'.out', sep=',')['Nb'].sum()
+    if 'N_B' not in parameters:
+        parameters['N_B'] = 0 if np.isnan(nb) else round(nb)
+    last = read_last_log(folder+filename)
+    last = last+[np.NaN]*(len(store.SWEEP_COLUMNS)-len(last))
+    return [filename, os.path.getmtime(folder+filename)] + [parameters.get(name, np.NaN) for name in PARAMETER_COLUMNS] + [nb] + last \
+           + [np.NaN, np.NaN, np.NaN]
+
+# Get the legacy log files of a folder that have no result store
+def legacy_files(folder):
+    return sorted(filename for filename in os.listdir(folder)
+                  if filename.endswith('.log') and not os.path.exists(folder+filename[:-4]+'.h5'))
+
+# Update the manifest of a folder with the new or modified result stores and return it
+# (with the legacy log files of the folder, which are read every time and not saved):
+#   filenames: None -> Check every result store of the folder
+#   filenames: list -> Only fold in the given result stores
+def update_manifest(folder, filenames=None):
+    manifest_file = folder+'manifest.csv'
+    manifest = pd.DataFrame(columns=MANIFEST_COLUMNS)
+    if os.path.exists(manifest_file):
+        manifest = pd.read_csv(manifest_file, sep=',')
+
+        # Rebuild manifests written with other columns
+        if list(manifest.columns) != MANIFEST_COLUMNS:
+            manifest = pd.DataFrame(columns=MANIFEST_COLUMNS)
+    modified = dict(zip(manifest['File'], manifest['Modified']))
+
+    if filenames is None:
+        filenames = store.result_files(folder)
+    rows = []
+    running = []
+    for filename in filenames:
+        if filename in modified and abs(os.path.getmtime(folder+filename)-modified[filename]) < 1e-3:
+            continue
+        if not store.finished(folder+filename):
+            running.append(filename)
+            continue
+        rows.append(manifest_row(folder, filename))
+
+    # Replace the rows of modified result stores and drop the ones being simulated again
+    if len(rows) > 0 or len(running) > 0:
+        rows = pd.DataFrame(rows, columns=MANIFEST_COLUMNS)
+        manifest = manifest[~manifest['File'].isin(list(rows['File'])+running)]
+        manifest = rows if len(manifest) == 0 else pd.concat([manifest, rows], ignore_index=True)
+        manifest.to_csv(manifest_file, index=False)
+
+    legacy = [legacy_manifest_row(folder, filename) for filename in legacy_files(folder)]
+    if len(legacy) > 0:
+        legacy = pd.DataFrame(legacy, columns=MANIFEST_COLUMNS)
+        manifest = legacy if len(manifest) == 0 else pd.concat([manifest, legacy], ignore_index=True)
+    return manifest.astype({'N_B': int, 'Sweeps': int})
+
+# Keep the last modified simulation for each value of the given parameter (stores named
+# before the key of the system was added to the filenames), sorted by that parameter
+def latest(manifest, name):
+    manifest = manifest.sort_values(by=['Modified']).drop_duplicates(subset=[name], keep='last')
+    return manifest.sort_values(by=[name], ignore_index=True)
+
+# Add the extrapolated energy and its error next to the raw energy, if any simulation has them
+def add_extrapolation(data, manifest):
+    if manifest['Energy_extrap'].notna().any():
+        position = list(data.columns).index('Energy')+1
+        data.insert(position, 'Energy_extrap', manifest['Energy_extrap'].values)
+        data.insert(position+1, 'Energy_extrap_error', manifest['Energy_extrap_error'].values)
+    return data
+
+# Add the correlation length of the infinite simulations (their energies are per site)
+def add_infinite(data, manifest):
+    if (manifest['bc_MPS'] == 'infinite').any():
+        data.insert(len(data.columns), 'Correlation_length', manifest['Correlation_length'].values)
+    return data
+
 # Get global information for a set of simulations with changing boson number
-def postproccesing_NB(folder):
+#   filenames: Result stores finished since the last call (None -> check the whole folder)
+def postproccesing_NB(folder, filenames=None):
 
     # Check folder format
     if folder[-1] != '/':
         folder = folder+'/'
 
-    # Get last line from each log file of the simulations
-    data = []
-    for file in os.listdir(os.fsencode(folder)):
-        filename = os.fsdecode(file)
-        if filename.endswith(".log"): 
-            nb = int(filename[filename.find('NB')+2:filename.find('NFU')-1])
-            data.append(np.concatenate(([nb], read_last(folder+filename))))
-
-    # Organice data in a pandas format
-    data = pd.DataFrame(data, columns=['NB', 'Sweeps', 'Time', 'Energy', 'Energy_error', 'Entropy', 'Entropy_error'])
-    data = data.astype({'NB': int, 'Sweeps': int})
-    data = data.sort_values(by=['NB'], ignore_index=True)
-
-    # Calculate boson chemical potential
-    old_nb = data['NB'][0]
-    mu = []
-    for ii in range(0, len(data['NB'])):
-        nb = data['NB'][ii]
-        if data['NB'][ii] == old_nb+1:
-            mu.append(data['Energy'][ii]-data['Energy'][ii-1])
-        else:
-            mu.append(np.NaN)
-        old_nb = data['NB'][ii]
+    # Get last sweep statistics from each result store of the simulations (a folder
+    # without results keeps its summary)
+    manifest = latest(update_manifest(folder, filenames), 'N_B')
+    if len(manifest) == 0:
+        return False
+    data = manifest[['N_B', 'Sweeps', 'Time', 'Energy', 'Energy_error', 'Entropy', 'Entropy_error']]
+    data = add_extrapolation(data.copy(), manifest)
+    data = add_infinite(data, manifest)
+    data = data.rename(columns={'N_B': 'NB'})
+
+    # Calculate boson chemical potential between consecutive boson numbers (with the
+    # extrapolated energies when they are available). The energies of infinite chains
+    # are per site and the boson numbers per unit cell, so they are taken per unit cell
+    energy = data['Energy'].values
+    if 'Energy_extrap' in data:
+        energy = data['Energy_extrap'].fillna(data['Energy']).values
+    energy = energy*np.where(manifest['bc_MPS'] == 'infinite', manifest['L'], 1)
+    consecutive = np.diff(data['NB'].values) == 1
+    mu = np.full(len(data), np.NaN)
+    mu[1:][consecutive] = (energy[1:]-energy[:-1])[consecutive]
     data.insert(4, 'Mu_B', mu, True)
 
     # Save data to folder
     filename = os.path.basename(os.path.normpath(folder))+'.txt'
     data.to_csv(folder+filename, index=False)
 
+# Get global information for a set of simulations with changing boson chemical
+# potential (without boson number conservation)
+#   filenames: Result stores finished since the last call (None -> check the whole folder)
+def postproccesing_MU(folder, filenames=None):
+
+    # Check folder format
+    if folder[-1] != '/':
+        folder = folder+'/'
+
+    # Get last sweep statistics and boson number from each result store (a folder
+    # without results keeps its summary)
+    manifest = latest(update_manifest(folder, filenames), 'mu_B')
+    if len(manifest) == 0:
+        return False
+    data = manifest[['mu_B', 'Sweeps', 'Time', 'Energy', 'Nb', 'Energy_error', 'Entropy', 'Entropy_error']]
+    data = add_extrapolation(data.copy(), manifest)
+    data = add_infinite(data, manifest)
+    data = data.rename(columns={'mu_B': 'MU_B', 'Nb': 'NB'})
+
+    # Save data to folder
+    filename = os.path.basename(os.path.normpath(folder))+'.txt'
+    data.to_csv(folder+filename, index=False)
+
+# Get the folders with result stores or legacy log files inside a results tree (cache excluded)
+def result_folders(root, exclude=['cache']):
+    folders = []
+    for path, dirnames, filenames in os.walk(root):
+        dirnames[:] = sorted(name for name in dirnames if os.path.relpath(os.path.join(path, name), root) not in exclude)
+        if len(store.result_files(path)) > 0 or len(legacy_files(os.path.join(path, ''))) > 0:
+            folders.append(os.path.join(path, ''))
+    return folders
+
+# Build the global index of a results tree: one table with the last sweep
+# statistics of every simulation, keyed by its parameters. The manifests of the
+# folders are updated in parallel, so only new result stores are read
+def build_index(root='results', cores=None):
+    folders = result_folders(root)
+    with multiprocessing.Pool(processes=cores) as pool:
+        manifests = pool.map(update_manifest, folders)
+
+    index = []
+    for folder, manifest in zip(folders, manifests):
+        manifest.insert(0, 'Folder', os.path.relpath(folder, root))
+        index.append(manifest)
+    index = pd.concat(index, ignore_index=True) if len(index) > 0 else pd.DataFrame(columns=['Folder']+MANIFEST_COLUMNS)
+    index.to_csv(os.path.join(root, 'index.csv'), index=False)
+    return index
+
+# Read the global index of a results tree, keeping the simulations with the given parameters
+#   read_index('results', L=60, U_BF=6.) -> Every simulation with L=60 and U_BF=6
+#   read_index('results', bc_MPS='infinite') -> Every infinite simulation
+def read_index(root='results', **parameters):
+    index = pd.read_csv(os.path.join(root, 'index.csv'), sep=',')
+    for name, value in parameters.items():
+        index = index[index[name] == value] if isinstance(value, str) else index[np.isclose(index[name], value)]
+    return index.reset_index(drop=True)
+
+# Measure again the final MPS saved in a result store, without running DMRG
+def measure_store(filepath, measure):
+    psi = store.read_psi(filepath)
+    BFModel.save_measurements(filepath, psi, measure, store.read(filepath, 'observables'))
+    return filepath
+
+# Measure the final MPS saved in the result stores of the given folders, in parallel
+#   measure: {'observables': One-site operators, 'correlations': Pairs of one-site operators,
+#             'schmidt_values': Largest Schmidt values of each charge sector}
+def postproccesing_measure(folders, measure, cores=None):
+    folders = [os.path.join(folder, '') for folder in folders]
+    filepaths = [folder+filename for folder in folders for filename in store.result_files(folder)
+                 if store.has_psi(folder+filename)]
+    with multiprocessing.Pool(processes=cores, initializer=parallel.set_threads, initargs=(1,)) as pool:
+        pool.starmap(measure_store, [(filepath, measure) for filepath in filepaths])
+    return filepaths
+
+# Aggregate the profiles of the simulations of the given folders: total time of each
+# phase and peak memory for each simulation, with the slowest simulations first
+def postproccesing_profile(folders):
+    phases = profiler.PROFILE_COLUMNS[2:-1]
+    data = []
+    for folder in [os.path.join(folder, '') for folder in folders]:
+        for filename in store.result_files(folder):
+            profile = store.read(folder+filename, 'profile')
+            if len(profile) == 0:
+                continue
+            sweeps = profiler.sweep_profile(profile)
+            data.append([folder+filename, len(sweeps)]+list(sweeps[phases].sum())+[sweeps['RSS'].max()])
+
+    data = pd.DataFrame(data, columns=['File', 'Sweeps']+phases+['RSS'])
+    data.insert(len(phases)+2, 'Total', data[phases].sum(axis=1))
+    return data.sort_values(by=['Total'], ascending=False, ignore_index=True)
+
 
 if __name__ == '__main__':
 
+    # Build the global index of the results tree (python postproccesing.py index [root])
+    if len(sys.argv) > 1 and sys.argv[1] == 'index':
+        root = sys.argv[2] if len(sys.argv) > 2 else 'results'
+        print('Indexing '+root, end=' ... ')
+        print(str(len(build_index(root)))+' simulations')
+        sys.exit()
+
+    # Summary of the profiles of the simulations of each requested folder (python postproccesing.py profile folders)
+    if len(sys.argv) > 1 and sys.argv[1] == 'profile':
+        data = postproccesing_profile(sys.argv[2:])
+        phases = profiler.PROFILE_COLUMNS[2:-1]
+        total = data['Total'].sum()
+        print('Profiled simulations: '+str(len(data))+', peak memory {:.0f} MB'.format(data['RSS'].max()))
+        for phase in phases:
+            print('{:12} {:10.1f} s ({:5.1f} %)'.format(phase, data[phase].sum(), 100*data[phase].sum()/max(total, 1e-12)))
+        print(data.head(10).to_string(index=False))
+        sys.exit()
+
+    # Measure the saved states of each requested folder (python postproccesing.py measure folders)
+    if len(sys.argv) > 1 and sys.argv[1] == 'measure':
+        with open('settings/measure.yml', 'r') as f:
+            parameters = yaml.safe_load(f)
+        measure = {name: parameters[name] for name in ['observables', 'correlations', 'schmidt_values']}
+        print('Measuring '+str(len(sys.argv)-2)+' folders', end=' ... ')
+        print(str(len(postproccesing_measure(sys.argv[2:], measure, parameters['cores'])))+' states')
+        sys.exit()
+
     # Analyse data from each requested folder
     for ii in range(1, len(sys.argv)):
         print('Processing '+sys.argv[ii], end=' ... ')
-        postproccesing_NB(sys.argv[ii])
-        print('Done')
+        if 'MUB' in sys.argv[ii]:
+            done = postproccesing_MU(sys.argv[ii])
+        else:
+            done = postproccesing_NB(sys.argv[ii])
+        print('No results' if done == False else 'Done')
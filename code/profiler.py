@@ -0,0 +1,88 @@
+import time
+import resource
+import numpy as np
+import pandas as pd
+
+# Columns of the profile of a simulation (one row for each bond update, times in seconds)
+PROFILE_COLUMNS = ['Sweep', 'Bond', 'Eff_H', 'Lanczos', 'SVD', 'Mixer', 'Environment', 'RSS']
+
+# Methods of the DMRG engine timed for each phase of a bond update
+#   Eff_H: Effective Hamiltonian and initial guess
+#   Lanczos: Ground state of the effective Hamiltonian
+#   SVD: Truncated decomposition of the new wave function
+#   Environment: Update of the left/right environments
+PHASES = {'prepare_update_local': 'Eff_H', 'diag': 'Lanczos', 'mixed_svd': 'SVD', 'update_env': 'Environment'}
+
+# Methods of the mixer timed as its own phase (the mixer is created again each time it
+# is activated, so it is wrapped when the decomposition uses it):
+#   Mixer: Perturbed density matrices of the density matrix mixer
+MIXER_PHASES = {'mix_rho': 'Mixer'}
+
+# Peak resident memory of the process (MB)
+def peak_rss():
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss/1024
+
+''' Profiler of the phases of the bond updates of a DMRG engine '''
+class Profiler:
+
+    """
+    Wraps the methods of a DMRG engine (instance only, the class and the
+    results are untouched) and records the time of each phase of every bond
+    update, together with the peak resident memory. The time of each phase
+    excludes the phases called inside it (the mixer inside the decomposition).
+    The profile recorded before a checkpoint (as given by table) continues
+    """
+
+    def __init__(self, engine, profile=None):
+        self.engine = engine
+        self.mixer = None
+        self.rows = []
+        if profile is not None:
+            self.rows = np.column_stack([profile[name] for name in PROFILE_COLUMNS]).tolist()
+        self.current = dict.fromkeys(PROFILE_COLUMNS[2:-1], 0.)
+        for method, phase in PHASES.items():
+            self.wrap(engine, method, phase)
+
+        # Close the row of the bond after each update
+        post_update_local = engine.post_update_local
+        def closed(**update_data):
+            result = post_update_local(**update_data)
+            self.rows.append([engine.sweeps+1, engine.i0]+list(self.current.values())+[peak_rss()])
+            self.current = dict.fromkeys(self.current, 0.)
+            return result
+        engine.post_update_local = closed
+
+    # Replace a method of the engine (or its mixer) by a timed version
+    def wrap(self, instance, method, phase):
+        function = getattr(instance, method)
+        def timed(*args, **kwargs):
+            if phase == 'SVD':
+                self.wrap_mixer()
+            inner = sum(self.current.values())
+            start = time.perf_counter()
+            result = function(*args, **kwargs)
+            elapsed = time.perf_counter()-start
+            self.current[phase] += elapsed-(sum(self.current.values())-inner)
+            return result
+        setattr(instance, method, timed)
+
+    # Time the methods of the current mixer of the engine (once for each mixer)
+    def wrap_mixer(self):
+        mixer = self.engine.mixer
+        if mixer is None or mixer is self.mixer:
+            return
+        self.mixer = mixer
+        for method, phase in MIXER_PHASES.items():
+            if hasattr(mixer, method):
+                self.wrap(mixer, method, phase)
+
+    # Profile of the bond updates done so far (one column for each entry of PROFILE_COLUMNS)
+    def table(self):
+        rows = np.array(self.rows, dtype=float).reshape(-1, len(PROFILE_COLUMNS))
+        return {name: rows[:, ii] for ii, name in enumerate(PROFILE_COLUMNS)}
+
+# Sum the profile of a simulation for each sweep (peak memory is the maximum)
+def sweep_profile(profile):
+    data = pd.DataFrame(profile).reindex(columns=PROFILE_COLUMNS)
+    data = data.groupby('Sweep').agg(dict({name: 'sum' for name in PROFILE_COLUMNS[2:-1]}, RSS='max'))
+    return data.reset_index()
@@ -2,14 +2,17 @@ import yaml
 
 import BFModel
 import misc
+import parallel
 
 # Read parameters
 with open('settings/run.yml', 'r') as f:
     parameters = yaml.safe_load(f)
 sim_parameters = misc.read_settings(parameters, 'results')
+parallel.set_threads(parameters['max_threads'])
 
 # Run simulation and notify telegram
 filename = sim_parameters['filename']
 misc.send_to_telegram('Started: \n'+filename, 'settings/telegram.yml')
-BFModel.run(sim_parameters)
+if BFModel.restore(sim_parameters) is None:
+    BFModel.run(sim_parameters)
 misc.send_to_telegram('Finished: \n'+filename, 'settings/telegram.yml')
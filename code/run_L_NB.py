@@ -1,10 +1,13 @@
 import os
-import multiprocessing
+import time
 import yaml
 
 import BFModel
 import misc
+import parallel
 import postproccesing
+import scheduler
+import workqueue
 
 # Read parameters for set of simulations
 with open('settings/run_L_NB.yml', 'r') as f:
@@ -22,6 +25,8 @@ L_list = []
 NB_list = []
 foldername_NB_list = []
 sim_parameters_list = []
+chain_list = []
+progress = ['▢'*(2*parameters['RES_B']+1)]*parameters['NL']
 for ii in range(0, parameters['NL']):
 
     # Change chain lenght(L)
@@ -43,13 +48,35 @@ for ii in range(0, parameters['NL']):
     parameters['N_FD'] = int(parameters['L']*parameters['RHO_FD'] + 0.5)
 
     # Save simulations for given range of NB
+    sim_parameters_L = []
     for jj in range(0, 2*parameters['RES_B']+1):
         parameters['N_B'] = NB_I + jj
-        sim_parameters_list.append(misc.read_settings(parameters, 'results/'+foldername_L+'/'+foldername_NB, ii*(2*parameters['RES_B']+1)+jj))
+        sim_parameters_L.append(misc.read_settings(parameters, 'results/'+foldername_L+'/'+foldername_NB, ii*(2*parameters['RES_B']+1)+jj))
         NB_list.append(parameters['N_B'])
+    sim_parameters_list.extend(sim_parameters_L)
 
-# Run all simulations in parallel while notifying telegram for each finished simulation
-progress = ['▢'*(2*parameters['RES_B']+1)]*parameters['NL']
+    # Restore cached simulations and send the rest to the pool
+    pending_L = []
+    for sim_parameters in sim_parameters_L:
+        if BFModel.restore(sim_parameters) is not None:
+            jj = sim_parameters['index']%(2*parameters['RES_B']+1)
+            progress[ii] = progress[ii][0:jj]+'▣'+progress[ii][jj+1:]
+        else:
+            pending_L.append(sim_parameters)
+    chain_list.extend(misc.create_chains(pending_L, parameters['chains'], parameters['warm_start']))
+
+    # Build each distinct model once, before creating the workers
+    BFModel.build_models(pending_L)
+
+    # Analyse data of the restored simulations for given L
+    postproccesing.postproccesing_NB('results/'+foldername_L+'/'+foldername_NB)
+
+# Dispatch the longest chains of simulations first
+timings = scheduler.read_timings(parameters['timings'])
+chain_list, times, completion = scheduler.schedule(chain_list, parameters['cores'], timings, parameters['max_threads'])
+
+# Run all simulations in parallel (local pool or shared work queue) while notifying
+# telegram for each finished simulation
 total_progress = progress[0]
 for n in range(1, len(progress)):
     total_progress = total_progress + '\n' + progress[n]
@@ -57,18 +84,24 @@ total_L = str(L_list[0])
 for n in range(1, len(L_list)):
     total_L = total_L+','+str(L_list[n])
 misc.send_to_telegram('Started: '+str(parameters['NL']*(2*parameters['RES_B']+1))+' jobs:\n'+foldername_L+'\n'+'L= '+total_L+'\n'+total_progress, 'settings/telegram.yml')
-pool = multiprocessing.Pool(processes=parameters['cores'])
-for result in pool.imap_unordered(BFModel.run, sim_parameters_list):
-    ii = result//(2*parameters['RES_B']+1)
-    jj = result%(2*parameters['RES_B']+1)
-    progress[ii] = progress[ii][0:jj]+'▣'+progress[ii][jj+1:]
+start = time.time()
+if parameters['queue'] is None:
+    memories = scheduler.chain_memories(chain_list, timings)
+    budget = None if parameters['memory'] is None else 1024*parameters['memory']
+    jobs = parallel.imap_hybrid(BFModel.run_chain, chain_list, parameters['cores'], parameters['max_threads'], memories, budget)
+else:
+    jobs = workqueue.imap_queue(parameters['queue'], chain_list, times)
+for results in jobs:
+    for result in results:
+        ii = result//(2*parameters['RES_B']+1)
+        jj = result%(2*parameters['RES_B']+1)
+        progress[ii] = progress[ii][0:jj]+'▣'+progress[ii][jj+1:]
 
-    # If all of simulations for given L are completed, analyse data
-    if progress[ii] == '▣'*(2*parameters['RES_B']+1):
-        postproccesing.postproccesing_NB('results/'+foldername_L+'/'+foldername_NB_list[ii])
+        # Fold the finished simulation into the analysed data for given L
+        postproccesing.postproccesing_NB('results/'+foldername_L+'/'+foldername_NB_list[ii], [sim_parameters_list[result]['filename']+'.h5'])
 
-    total_progress = progress[0]
-    for n in range(1, len(progress)):
-        total_progress = total_progress + '\n' + progress[n]
-    misc.send_to_telegram('Finished L='+str(L_list[ii])+' NB='+str(NB_list[result])+' from\n'+foldername_L+'\n'+total_progress, 'settings/telegram.yml')
-misc.send_to_telegram('Finished:\n'+foldername_L, 'settings/telegram.yml')
+        total_progress = progress[0]
+        for n in range(1, len(progress)):
+            total_progress = total_progress + '\n' + progress[n]
+        misc.send_to_telegram('Finished L='+str(L_list[ii])+' NB='+str(NB_list[result])+' from\n'+foldername_L+'\n'+total_progress, 'settings/telegram.yml')
+misc.send_to_telegram('Finished:\n'+foldername_L+'\n'+scheduler.report(completion, time.time()-start, timings), 'settings/telegram.yml')
@@ -0,0 +1,76 @@
+import os
+import time
+import yaml
+
+import BFModel
+import misc
+import parallel
+import postproccesing
+import scheduler
+import workqueue
+
+# Read parameters for set of simulations
+with open('settings/run_MU.yml', 'r') as f:
+    parameters = yaml.safe_load(f)
+
+# Use a unit cell commensurate with the fermion densities for an infinite chain
+if parameters['bc_MPS'] == 'infinite':
+    parameters['L'] = misc.unit_cell(parameters['L'], [parameters['RHO_FU'], parameters['RHO_FD']])
+
+# Create folder for results
+foldername = misc.create_name(parameters, 'MU')
+if not os.path.exists('results'):
+    os.mkdir('results')
+if not os.path.exists('results/'+foldername):
+    os.mkdir('results/'+foldername)
+
+# Calculate particle numbers of the initial state
+parameters['N_B']  = int(parameters['L']*parameters['RHO_B']  + 0.5)
+parameters['N_FU']  = int(parameters['L']*parameters['RHO_FU']  + 0.5)
+parameters['N_FD']  = int(parameters['L']*parameters['RHO_FD']  + 0.5)
+
+# Save set of parameters for simulations
+sim_parameters_list = []
+mu_list = []
+for jj in range(0, parameters['NMU']):
+    parameters['MU_B'] = parameters['MU_B_I'] + jj*(parameters['MU_B_F']-parameters['MU_B_I'])/max(parameters['NMU']-1, 1)
+    sim_parameters_list.append(misc.read_settings(parameters, 'results/'+foldername, jj))
+    mu_list.append(parameters['MU_B'])
+
+# Restore cached simulations and send the rest to the pool
+progress = '▢'*parameters['NMU']
+pending_list = []
+for sim_parameters in sim_parameters_list:
+    if BFModel.restore(sim_parameters) is not None:
+        result = sim_parameters['index']
+        progress = progress[0:result]+'▣'+progress[result+1:]
+    else:
+        pending_list.append(sim_parameters)
+chain_list = misc.create_chains(pending_list, parameters['chains'], parameters['warm_start'])
+
+# Build each distinct model once, before creating the workers
+BFModel.build_models(pending_list)
+
+# Dispatch the longest chains of simulations first
+timings = scheduler.read_timings(parameters['timings'])
+chain_list, times, completion = scheduler.schedule(chain_list, parameters['cores'], timings, parameters['max_threads'])
+
+# Run all simulations in parallel (local pool or shared work queue) while notifying
+# telegram for each finished simulation
+misc.send_to_telegram('Started: '+str(parameters['NMU'])+' jobs:\n'+foldername+'\nMU_B= '+str(parameters['MU_B_I'])+':'+str(parameters['MU_B_F'])+'\n'+progress, 'settings/telegram.yml')
+start = time.time()
+if parameters['queue'] is None:
+    memories = scheduler.chain_memories(chain_list, timings)
+    budget = None if parameters['memory'] is None else 1024*parameters['memory']
+    jobs = parallel.imap_hybrid(BFModel.run_chain, chain_list, parameters['cores'], parameters['max_threads'], memories, budget)
+else:
+    jobs = workqueue.imap_queue(parameters['queue'], chain_list, times)
+for results in jobs:
+    for result in results:
+        progress = progress[0:result]+'▣'+progress[result+1:]
+        postproccesing.postproccesing_MU('results/'+foldername, [sim_parameters_list[result]['filename']+'.h5'])
+        misc.send_to_telegram('Finished MU_B='+str(mu_list[result])+' from\n'+foldername+'\n'+progress, 'settings/telegram.yml')
+
+# Get global results from all of the simulations (restored ones included)
+postproccesing.postproccesing_MU('results/'+foldername)
+misc.send_to_telegram('Finished:\n'+foldername+'\n'+scheduler.report(completion, time.time()-start, timings), 'settings/telegram.yml')
@@ -1,15 +1,22 @@
 import os
-import multiprocessing
+import time
 import yaml
 
 import BFModel
 import misc
+import parallel
 import postproccesing
+import scheduler
+import workqueue
 
 # Read parameters for set of simulations
 with open('settings/run_NB.yml', 'r') as f:
     parameters = yaml.safe_load(f)
 
+# Use a unit cell commensurate with the fermion densities for an infinite chain
+if parameters['bc_MPS'] == 'infinite':
+    parameters['L'] = misc.unit_cell(parameters['L'], [parameters['RHO_FU'], parameters['RHO_FD']])
+
 # Create folder for results
 foldername = misc.create_name(parameters, 'NB')
 if not os.path.exists('results'):
@@ -29,14 +36,40 @@ for nb in range(NB_I, NB_F+1):
     parameters['N_B'] = nb
     sim_parameters_list.append(misc.read_settings(parameters, 'results/'+foldername, nb))
 
-# Run all simulations in parallel while notifying telegram for each finished simulation
+# Restore cached simulations and send the rest to the pool
 progress = '▢'*(NB_F-NB_I+1)
+pending_list = []
+for sim_parameters in sim_parameters_list:
+    if BFModel.restore(sim_parameters) is not None:
+        result = sim_parameters['index']
+        progress = progress[0:result-NB_I]+'▣'+progress[result-NB_I+1:]
+    else:
+        pending_list.append(sim_parameters)
+chain_list = misc.create_chains(pending_list, parameters['chains'], parameters['warm_start'])
+
+# Build each distinct model once, before creating the workers
+BFModel.build_models(pending_list)
+
+# Dispatch the longest chains of simulations first
+timings = scheduler.read_timings(parameters['timings'])
+chain_list, times, completion = scheduler.schedule(chain_list, parameters['cores'], timings, parameters['max_threads'])
+
+# Run all simulations in parallel (local pool or shared work queue) while notifying
+# telegram for each finished simulation
 misc.send_to_telegram('Started: '+str(NB_F-NB_I+1)+' jobs:\n'+foldername+'\nNB= '+str(NB_I)+':'+str(NB_F)+'\n'+progress, 'settings/telegram.yml')
-pool = multiprocessing.Pool(processes=parameters['cores'])
-for result in pool.imap_unordered(BFModel.run, sim_parameters_list):
-    progress = progress[0:result-NB_I]+'▣'+progress[result-NB_I+1:]
-    misc.send_to_telegram('Finished NB='+str(result)+' from\n'+foldername+'\n'+progress, 'settings/telegram.yml')
+start = time.time()
+if parameters['queue'] is None:
+    memories = scheduler.chain_memories(chain_list, timings)
+    budget = None if parameters['memory'] is None else 1024*parameters['memory']
+    jobs = parallel.imap_hybrid(BFModel.run_chain, chain_list, parameters['cores'], parameters['max_threads'], memories, budget)
+else:
+    jobs = workqueue.imap_queue(parameters['queue'], chain_list, times)
+for results in jobs:
+    for result in results:
+        progress = progress[0:result-NB_I]+'▣'+progress[result-NB_I+1:]
+        postproccesing.postproccesing_NB('results/'+foldername, [sim_parameters_list[result-NB_I]['filename']+'.h5'])
+        misc.send_to_telegram('Finished NB='+str(result)+' from\n'+foldername+'\n'+progress, 'settings/telegram.yml')
 
-# Get global results from all of the simulations
+# Get global results from all of the simulations (restored ones included)
 postproccesing.postproccesing_NB('results/'+foldername)
-misc.send_to_telegram('Finished:\n'+foldername, 'settings/telegram.yml')
+misc.send_to_telegram('Finished:\n'+foldername+'\n'+scheduler.report(completion, time.time()-start, timings), 'settings/telegram.yml')
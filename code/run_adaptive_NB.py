@@ -0,0 +1,120 @@
+import os
+import time
+import yaml
+
+import BFModel
+import misc
+import parallel
+import postproccesing
+import scheduler
+
+# Read parameters for set of simulations
+with open('settings/run_adaptive_NB.yml', 'r') as f:
+    parameters = yaml.safe_load(f)
+
+# Create folder for results
+foldername = misc.create_name(parameters, 'NB')
+if not os.path.exists('results'):
+    os.mkdir('results')
+if not os.path.exists('results/'+foldername):
+    os.mkdir('results/'+foldername)
+
+# Calculate bounds for boson number
+NB_I = int(parameters['L']*parameters['RHO_B_I'] + 0.5)
+NB_F = int(parameters['L']*parameters['RHO_B_F'] + 0.5)
+parameters['N_FU']  = int(parameters['L']*parameters['RHO_FU']  + 0.5)
+parameters['N_FD']  = int(parameters['L']*parameters['RHO_FD']  + 0.5)
+
+# Get energies for a set of boson numbers, running only the missing simulations
+energy = {}
+timings = scheduler.read_timings(parameters['timings'])
+def get_energies(nb_list):
+
+    # Chain consecutive boson numbers
+    chain_list = []
+    filenames = {}
+    for nb in sorted(set(nb_list)):
+        if nb in energy or nb < NB_I or nb > NB_F:
+            continue
+        parameters['N_B'] = nb
+        sim_parameters = misc.read_settings(parameters, 'results/'+foldername, nb)
+        filenames[nb] = sim_parameters['filename']
+        if parameters['warm_start'] and len(chain_list) > 0 and chain_list[-1][-1]['index'] == nb-1:
+            chain_list[-1].append(sim_parameters)
+        else:
+            chain_list.append([sim_parameters])
+
+    # Build each distinct model once, before creating the workers
+    BFModel.build_models([sim_parameters for chain in chain_list for sim_parameters in chain])
+
+    # Run simulations and read the final energy
+    chain_list, times, completion = scheduler.schedule(chain_list, parameters['cores'], timings, parameters['max_threads'])
+    memories = scheduler.chain_memories(chain_list, timings)
+    budget = None if parameters['memory'] is None else 1024*parameters['memory']
+    for results in parallel.imap_hybrid(BFModel.run_chain, chain_list, parameters['cores'], parameters['max_threads'], memories, budget):
+        for nb in results:
+            energy[nb] = postproccesing.read_last('results/'+foldername+'/'+filenames[nb]+'.h5')[2]
+
+# Boson chemical potential (Mu_B(NB) = E(NB)-E(NB-1))
+def mu(nb):
+    return energy[nb]-energy[nb-1]
+
+# Probe up to a number of boson numbers evenly spaced inside (lo, hi)
+def probes(lo, hi):
+    n = min(parameters['points'], hi-lo-1)
+    return sorted(set(lo+((hi-lo)*(ii+1))//(n+1) for ii in range(0, n)))
+
+misc.send_to_telegram('Started search: '+parameters['SEARCH']+'\n'+foldername+'\nNB= '+str(NB_I)+':'+str(NB_F), 'settings/telegram.yml')
+start = time.time()
+
+if parameters['SEARCH'] == 'mu':
+
+    # Refine the interval where Mu_B crosses MU_B (Mu_B(lo) < MU_B <= Mu_B(hi)),
+    # using that Mu_B increases with the boson number
+    lo = NB_I
+    hi = NB_F+1
+    while hi-lo > 1:
+        nb_list = probes(lo, hi)
+        get_energies(nb_list+[nb-1 for nb in nb_list])
+        for nb in nb_list:
+            if mu(nb) < parameters['MU_B']:
+                lo = max(lo, nb)
+            else:
+                hi = min(hi, nb)
+
+    # Ground state at MU_B has the largest boson number with Mu_B < MU_B
+    message = 'MU_B={} -> NB={} (RHO_B={:.4f})'.format(parameters['MU_B'], lo, lo/parameters['L'])
+
+elif parameters['SEARCH'] == 'gaps' and NB_F-NB_I < 2:
+
+    # A gap needs two values of Mu_B, that is three boson numbers: only get the energies
+    get_energies(list(range(NB_I, NB_F+1)))
+    message = 'Gaps (GAP_TOL={}): none, NB={}:{} has fewer than two values of Mu_B'.format(parameters['GAP_TOL'], NB_I, NB_F)
+
+elif parameters['SEARCH'] == 'gaps':
+
+    # Refine intervals where Mu_B jumps more than GAP_TOL until the jumps are
+    # located between consecutive boson numbers
+    nb_list = [NB_I+1]+probes(NB_I+1, NB_F)+[NB_F]
+    get_energies(nb_list+[nb-1 for nb in nb_list])
+    intervals = [[nb_list[ii], nb_list[ii+1]] for ii in range(0, len(nb_list)-1)]
+    while True:
+        refine = [[a, b] for a, b in intervals if b-a > 1 and mu(b)-mu(a) > parameters['GAP_TOL']]
+        if len(refine) == 0:
+            break
+        nb_list = [(a+b)//2 for a, b in refine]
+        get_energies(nb_list+[nb-1 for nb in nb_list])
+        for a, b in refine:
+            intervals.remove([a, b])
+            intervals.extend([[a, (a+b)//2], [(a+b)//2, b]])
+
+    # Gaps at boson number a between Mu_B(a) and Mu_B(a+1)
+    message = 'Gaps (GAP_TOL={}):'.format(parameters['GAP_TOL'])
+    for a, b in sorted(intervals):
+        if b == a+1 and mu(b)-mu(a) > parameters['GAP_TOL']:
+            message += '\nNB={} (RHO_B={:.4f}): Mu_B={:.6f} -> {:.6f}'.format(a, a/parameters['L'], mu(a), mu(b))
+
+# Get global results from the simulations done
+postproccesing.postproccesing_NB('results/'+foldername)
+print(message)
+misc.send_to_telegram('Finished search:\n'+foldername+'\n'+message+'\n'+str(len(energy))+' of '+str(NB_F-NB_I+1)+' jobs in {:.0f} s'.format(time.time()-start), 'settings/telegram.yml')
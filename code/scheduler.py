@@ -0,0 +1,175 @@
+import os
+import fcntl
+import heapq
+import numpy as np
+import pandas as pd
+
+import parallel
+
+# Columns of the timings file (Memory is the peak resident memory in MB)
+TIMING_COLUMNS = ['L', 'N_B_max', 'N_B', 'N_FU', 'N_FD', 'chi', 'chi_max', 'Time', 'Memory']
+
+# Columns of the timings file that determine the cost and the memory of a simulation
+# (chi, the first bond dimension, only tells schedules with the same largest one apart)
+COST_COLUMNS = TIMING_COLUMNS[:7]
+MEMORY_COLUMNS = TIMING_COLUMNS[:5]+['chi_max']
+
+# Bond dimension of the MPO of the model (next-neighbor hoppings and interactions)
+MPO_DIM = 10
+
+# Vectors of the two-site wave function kept by the Lanczos solver (N_cache of tenpy)
+N_LANCZOS = 20
+
+# Memory of a worker before any simulation (python, numpy and tenpy, MB)
+BASE_MEMORY = 150.
+
+# Get the parameters that determine the cost of a simulation: first bond dimension of the
+# schedule and largest bond dimension it can reach (parallel.bond_dimension)
+def cost_parameters(sim_parameters):
+    model_params = sim_parameters['model_params']
+    initial_state_params = sim_parameters['initial_state_params']
+    return [model_params['L'], model_params['N_B_max'],
+            initial_state_params['N_B'], initial_state_params['N_FU'], initial_state_params['N_FD'],
+            sim_parameters['algorithm_params']['chi_list'][0], parallel.bond_dimension(sim_parameters)]
+
+# Get the parameters that determine the peak memory of a simulation (largest bond dimension)
+def memory_parameters(sim_parameters):
+    parameters = cost_parameters(sim_parameters)
+    return parameters[:5]+parameters[-1:]
+
+# Model for the cost of a simulation (arbitrary units):
+#   Each sweep costs L*(d*chi)^3, with chi the largest bond dimension of the schedule
+#   limited by the dimension of the half chain, and product states (empty or full
+#   bands) converge much faster than partial fillings
+def model_cost(L, N_B_max, N_B, N_FU, N_FD, chi, chi_max):
+    d = 4*(N_B_max+1)
+    chi = min(chi_max, d**(L//2))
+    mobility = 0.1
+    for x in [N_B/(L*N_B_max), N_FU/L, N_FD/L]:
+        mobility += x*(1-x)
+    return L*(d*chi)**3*mobility
+
+# Model for the peak memory of a simulation (MB):
+#   The two-site DMRG keeps the MPS (L*d*chi^2), the left and right environments
+#   (2*L*MPO_DIM*chi^2) and the Lanczos vectors of the two-site wave function
+#   (N_LANCZOS*d^2*chi^2), with chi limited by the dimension of the half chain.
+#   Charge conservation only stores the blocks allowed by the charges: each conserved
+#   number spreads over about sqrt(n) sectors on a bond, and the tensors keep roughly
+#   a fraction 1/sectors of their dense size
+def model_memory(L, N_B_max, N_B, N_FU, N_FD, chi_max):
+    d = 4*(N_B_max+1)
+    chi = min(chi_max, d**(L//2))
+    sectors = 1.
+    for n, n_max in [(N_B, L*N_B_max), (N_FU, L), (N_FD, L)]:
+        sectors *= 1+np.sqrt(max(0, min(n, n_max-n)))
+    elements = (L*d+2*L*MPO_DIM+N_LANCZOS*d**2)*chi**2/min(sectors, chi)
+    return BASE_MEMORY+8*elements/1024**2
+
+# Append the measured time and peak memory of a simulation to the timings file, locked
+# while writing since the workers of a pool share it
+def save_timing(filepath, sim_parameters, time, memory=None):
+    if filepath is None:
+        return
+    values = cost_parameters(sim_parameters)+[time, memory]
+    line = ','.join('' if value is None else str(value) for value in values)+'\n'
+
+    with open(filepath, 'a+') as f:
+        fcntl.flock(f, fcntl.LOCK_EX)
+        f.seek(0)
+        header = f.readline().strip()
+        if header == '':
+            f.write(','.join(TIMING_COLUMNS)+'\n')
+
+        # Files written before a column was added are rewritten with the current columns
+        elif header.split(',') != TIMING_COLUMNS:
+            f.seek(0)
+            timings = pd.read_csv(f, sep=',').reindex(columns=TIMING_COLUMNS)
+            f.truncate(0)
+            timings.to_csv(f, index=False)
+        f.write(line)
+
+# Read measured times of previous simulations
+def read_timings(filepath):
+    if filepath is None or not os.path.exists(filepath) or os.path.getsize(filepath) == 0:
+        return pd.DataFrame(columns=TIMING_COLUMNS)
+    return pd.read_csv(filepath, sep=',').reindex(columns=TIMING_COLUMNS)
+
+# Estimate the time of a simulation (seconds if there are measured times, arbitrary units if not):
+#   Simulations already measured use the mean measured time, the rest use the
+#   cost model scaled by the median time/cost ratio of the measured simulations
+def estimate_time(sim_parameters, timings):
+    parameters = cost_parameters(sim_parameters)
+    timings = timings.dropna(subset=COST_COLUMNS+['Time'])
+    if len(timings) == 0:
+        return model_cost(*parameters)
+
+    same = np.all(timings[COST_COLUMNS].values == parameters, axis=1)
+    if np.any(same):
+        return timings['Time'][same].mean()
+
+    costs = [model_cost(*row) for row in timings[COST_COLUMNS].values]
+    return np.median(timings['Time'].values/costs)*model_cost(*parameters)
+
+# Estimate the peak memory of a simulation (MB):
+#   Simulations already measured use the largest measured peak (a worker reports the peak
+#   of all its simulations, on the safe side). The rest use the memory model with the
+#   part above BASE_MEMORY scaled (up or down) by the median measured/predicted ratio of
+#   that part, so small simulations dominated by the base memory do not hide the growth with chi
+def estimate_memory(sim_parameters, timings):
+    parameters = memory_parameters(sim_parameters)
+    timings = timings.dropna(subset=MEMORY_COLUMNS+['Memory'])
+    if len(timings) == 0:
+        return model_memory(*parameters)
+
+    same = np.all(timings[MEMORY_COLUMNS].values == parameters, axis=1)
+    if np.any(same):
+        return timings['Memory'][same].max()
+
+    models = np.array([model_memory(*row) for row in timings[MEMORY_COLUMNS].values])-BASE_MEMORY
+    ratio = max(0.1, np.median(np.maximum(timings['Memory'].values-BASE_MEMORY, 0.)/models))
+    return BASE_MEMORY+ratio*(model_memory(*parameters)-BASE_MEMORY)
+
+# Simulate the dispatch of jobs with the given times and threads to the cores (in
+# order, while their threads fit in the free cores, with a linear speedup with the
+# threads) and return the completion time of each job
+def predict_completion(times, threads_list, cores):
+    running = []
+    free = cores
+    now = 0.
+    completion = []
+    for time, threads in zip(times, threads_list):
+        while free < threads and len(running) > 0:
+            now, released = heapq.heappop(running)
+            free += released
+        completion.append(now+time/threads)
+        heapq.heappush(running, (now+time/threads, threads))
+        free -= threads
+    return completion
+
+# Estimate the peak memory of each chain of simulations (MB): the simulations of a
+# chain run one after the other, so it is the largest peak of the chain
+def chain_memories(chain_list, timings):
+    return [max(estimate_memory(sim_parameters, timings) for sim_parameters in chain) for chain in chain_list]
+
+# Sort chains of simulations by estimated time, longest first, to minimize the
+# total time of the batch. Returns the sorted chains, their estimated times and
+# their predicted completion when they share the cores
+def schedule(chain_list, cores, timings, max_threads=1):
+    times = [sum(estimate_time(sim_parameters, timings) for sim_parameters in chain) for chain in chain_list]
+    order = sorted(range(0, len(chain_list)), key=lambda ii: times[ii], reverse=True)
+    chain_list = [chain_list[ii] for ii in order]
+    times = [times[ii] for ii in order]
+
+    # Predict completion of the chains sharing the cores
+    threads_list = [parallel.chain_threads(chain, max_threads) for chain in chain_list]
+    completion = predict_completion(times, threads_list, cores)
+
+    return chain_list, times, completion
+
+# Create report of the predicted and actual completion time of a batch
+def report(completion, elapsed, timings):
+    if len(completion) == 0:
+        return 'No jobs to run'
+    if len(timings) == 0:
+        return 'Finished in {:.0f} s (no measured times for prediction)'.format(elapsed)
+    return 'Finished in {:.0f} s (predicted {:.0f} s)'.format(elapsed, max(completion))
@@ -0,0 +1,176 @@
+import os
+import json
+import h5py
+import numpy as np
+import pandas as pd
+
+from tenpy.tools import hdf5_io
+
+''' Result store of a simulation (one HDF5 file per simulation) '''
+#   sweep_stats: One dataset for each column of the sweep statistics (appended while running)
+#   observables: Final energy, one-site observables, correlation matrices A_B and their
+#                Fourier transforms A_B_k at the momenta k
+#   entanglement: Entropy of each bond (float32) and the largest Schmidt values of each
+#                 charge sector of each bond, as flat columns bond, charges, values
+#   profile: Time of each phase of every bond update and peak memory (only if profile is True)
+#   extrapolation: Bond dimension, truncation error and energy at the end of each bond
+#                  dimension stage, and the extrapolated energy and its error as attributes
+#                  (only if extrapolation is True)
+#   metadata: Parameters of the simulation as attributes and tenpy log
+#   psi: Final MPS with its charge data, compressed (only if save_mps is True)
+
+# Type of the lists of numpy arrays saved as one compressed dataset
+REPR_PACKED = 'packed_arrays'
+
+''' Saver of tenpy objects with compressed arrays '''
+class CompressedSaver(hdf5_io.Hdf5Saver):
+
+    """
+    Saves numpy arrays as gzip compressed datasets, and lists of numpy arrays
+    with the same dtype and rank (the charge blocks of each tensor of the MPS,
+    mostly too small to compress one by one) as one compressed dataset with
+    their shapes; the rest is saved as in tenpy. Loaded with CompressedLoader
+    """
+
+    def save_compressed(self, obj, path, type_repr):
+        if obj.size < 1024:
+            return self.save_dataset(obj, path, type_repr)
+        h5gr = self.h5group.create_dataset(path, data=obj, compression='gzip', shuffle=True)
+        h5gr.attrs[hdf5_io.ATTR_TYPE] = type_repr
+        self.memorize_save(h5gr, obj)
+        return h5gr
+
+    def save_list(self, obj, path, type_repr):
+        if len(obj) == 0 or any(type(block) is not np.ndarray for block in obj):
+            return self.save_iterable(obj, path, type_repr)
+        if obj[0].ndim == 0 or any(block.dtype != obj[0].dtype or block.ndim != obj[0].ndim for block in obj):
+            return self.save_iterable(obj, path, type_repr)
+        h5gr, subpath = self.create_group_for_obj(path, obj)
+        h5gr.attrs[hdf5_io.ATTR_TYPE] = REPR_PACKED
+        data = np.concatenate([block.ravel() for block in obj])
+        h5gr.create_dataset('data', data=data, compression='gzip' if data.size > 0 else None, shuffle=data.size > 0)
+        h5gr.create_dataset('shapes', data=np.array([block.shape for block in obj], dtype=np.int64))
+        return h5gr
+
+    dispatch_save = dict(hdf5_io.Hdf5Saver.dispatch_save)
+    dispatch_save[np.ndarray] = (save_compressed, dispatch_save[np.ndarray][1])
+    dispatch_save[list] = (save_list, dispatch_save[list][1])
+
+''' Loader of tenpy objects saved by CompressedSaver '''
+class CompressedLoader(hdf5_io.Hdf5Loader):
+
+    """
+    Loads the lists of numpy arrays packed by CompressedSaver; the rest
+    (and MPS saved before the lists were packed) is loaded as in tenpy
+    """
+
+    def load_packed(self, h5gr, type_info, subpath):
+        obj = []
+        self.memorize_load(h5gr, obj)
+        data, shapes = h5gr['data'][()], h5gr['shapes'][()]
+        start = 0
+        for shape in shapes:
+            size = int(np.prod(shape))
+            obj.append(data[start:start+size].reshape(shape))
+            start += size
+        return obj
+
+    dispatch_load = dict(hdf5_io.Hdf5Loader.dispatch_load)
+    dispatch_load[REPR_PACKED] = (load_packed, None)
+
+# Columns of the sweep statistics
+SWEEP_COLUMNS = ['Sweep', 'Time', 'Energy', 'Energy_error', 'Entropy', 'Entropy_error', 'Trunc_error', 'Chi']
+
+# Columns of the energy extrapolation (one row for each bond dimension stage)
+EXTRAPOLATION_COLUMNS = ['Chi', 'Trunc_error', 'Energy']
+
+# Write columns and attributes in a group of the result store, replacing the group
+def write(filepath, group, columns={}, attrs={}):
+    with h5py.File(filepath, 'a') as f:
+        if group in f:
+            del f[group]
+        g = f.create_group(group)
+        for name in columns:
+            g.create_dataset(name, data=columns[name])
+        for name in attrs:
+            if attrs[name] is not None:
+                g.attrs[name] = attrs[name]
+
+# Append rows to the columns of a group of the result store, creating them if needed
+def append(filepath, group, columns):
+    with h5py.File(filepath, 'a') as f:
+        g = f.require_group(group)
+        for name in columns:
+            data = np.asarray(columns[name])
+            if name not in g:
+                g.create_dataset(name, data=data, maxshape=(None,), chunks=True)
+            else:
+                g[name].resize((g[name].shape[0]+len(data),))
+                g[name][-len(data):] = data
+
+# Read the columns of a group of the result store
+def read(filepath, group):
+    with h5py.File(filepath, 'r') as f:
+        if group not in f:
+            return {}
+        return {name: f[group][name][()] for name in f[group]}
+
+# Read the attributes of a group of the result store
+def read_attrs(filepath, group):
+    with h5py.File(filepath, 'r') as f:
+        if group not in f:
+            return {}
+        return dict(f[group].attrs)
+
+# Write the metadata of a simulation: scalar parameters as attributes, all
+# parameters as json and the tenpy log
+def write_metadata(filepath, sim_parameters, log):
+    attrs = {'parameters': json.dumps({key: sim_parameters[key] for key in ['model_params', 'initial_state_params', 'algorithm_params']}, default=str)}
+    for key in ['model_params', 'initial_state_params']:
+        for name, value in sim_parameters[key].items():
+            if isinstance(value, (bool, int, float, str)):
+                attrs[name] = value
+    write(filepath, 'metadata', {'log': log}, attrs)
+
+# Write the final MPS of a simulation, replacing the previous one
+def write_psi(filepath, psi):
+    with h5py.File(filepath, 'a') as f:
+        if 'psi' in f:
+            del f['psi']
+        CompressedSaver(f).save(psi, 'psi')
+
+# Read the final MPS of a simulation (None if it was not saved)
+def read_psi(filepath):
+    with h5py.File(filepath, 'r') as f:
+        if 'psi' not in f:
+            return None
+        return CompressedLoader(f).load('psi')
+
+# Check if the final MPS of a simulation was saved
+def has_psi(filepath):
+    with h5py.File(filepath, 'r') as f:
+        return 'psi' in f
+
+# Read the tenpy log of a simulation
+def read_log(filepath):
+    with h5py.File(filepath, 'r') as f:
+        return f['metadata']['log'].asstr()[()]
+
+# Read the sweep statistics as a table
+def read_sweep_stats(filepath):
+    data = pd.DataFrame(read(filepath, 'sweep_stats')).reindex(columns=SWEEP_COLUMNS)
+    return data.astype({'Sweep': int})
+
+# Check if a result store belongs to a finished simulation (not a running one,
+# which may be writing the store at this moment)
+def finished(filepath):
+    try:
+        with h5py.File(filepath, 'r') as f:
+            return 'observables' in f
+    except OSError:
+        return False
+
+# Get the result stores in a folder (checkpoints excluded)
+def result_files(folder):
+    return sorted(filename for filename in os.listdir(folder)
+                  if filename.endswith('.h5') and not filename.endswith('.ckpt.h5'))
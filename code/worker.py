@@ -0,0 +1,29 @@
+import sys
+import multiprocessing
+
+import BFModel
+import parallel
+import workqueue
+
+# Run jobs of the queue with the given number of BLAS threads
+def run_worker(filepath, threads, idle):
+    parallel.set_threads(threads)
+    workqueue.work(filepath, BFModel.run_chain, idle)
+
+if __name__ == '__main__':
+
+    # Start workers on this node: python code/worker.py queue [processes] [threads] [idle]
+    #   queue: SQLite file of the work queue (shared between nodes)
+    #   processes: Number of worker processes
+    #   threads: BLAS threads of each worker process
+    #   idle: Seconds to wait for new jobs before exiting
+    filepath = sys.argv[1]
+    processes = int(sys.argv[2]) if len(sys.argv) > 2 else 1
+    threads = int(sys.argv[3]) if len(sys.argv) > 3 else 1
+    idle = float(sys.argv[4]) if len(sys.argv) > 4 else 60
+
+    workers = [multiprocessing.Process(target=run_worker, args=(filepath, threads, idle)) for ii in range(0, processes)]
+    for worker in workers:
+        worker.start()
+    for worker in workers:
+        worker.join()
@@ -0,0 +1,145 @@
+import os
+import time
+import json
+import pickle
+import socket
+import sqlite3
+import threading
+
+import cache
+
+# Seconds a worker keeps a job without renewing its lease
+LEASE_TIME = 600
+
+# Attempts of a job before it is marked as failed
+MAX_ATTEMPTS = 3
+
+''' Work queue shared between nodes (SQLite file on shared storage) '''
+#   jobs: One row for each chain of simulations
+#     key      : Keys of the simulations of the chain
+#     spec     : Chain of simulation parameters (pickle, json would turn the keys of chi_list into strings)
+#     priority : Estimated time of the chain (longest first)
+#     status   : pending, running, done or failed
+#     worker   : Host and process of the worker running the job
+#     lease    : Time when the job is given to another worker if not renewed
+#     attempts : Number of times the job was claimed
+#     result   : Result of the job (json) or error message
+
+# Open connection to the queue, creating the table if needed
+def connect(filepath):
+    connection = sqlite3.connect(filepath, timeout=60, isolation_level=None)
+    connection.execute('''CREATE TABLE IF NOT EXISTS jobs (
+                              id INTEGER PRIMARY KEY, key TEXT UNIQUE, spec BLOB, priority REAL,
+                              status TEXT, worker TEXT, lease REAL, attempts INTEGER, result TEXT)''')
+    return connection
+
+# Name of the current worker
+def worker_name():
+    return socket.gethostname()+':'+str(os.getpid())
+
+# Add chains of simulations to the queue and return their ids:
+#   Chains already in the queue are reused, and queued again if they were finished
+def enqueue(filepath, chain_list, times):
+    connection = connect(filepath)
+    ids = []
+    connection.execute('BEGIN IMMEDIATE')
+    for chain, time_chain in zip(chain_list, times):
+        key = ','.join(cache.create_key(sim_parameters) for sim_parameters in chain)
+        connection.execute('''INSERT INTO jobs (key, spec, priority, status, attempts) VALUES (?, ?, ?, 'pending', 0)
+                              ON CONFLICT(key) DO UPDATE SET spec=excluded.spec, priority=excluded.priority,
+                              status='pending', attempts=0, result=NULL WHERE status IN ('done', 'failed')''',
+                           (key, pickle.dumps(chain), float(time_chain)))
+        ids.append(connection.execute('SELECT id FROM jobs WHERE key=?', (key,)).fetchone()[0])
+    connection.execute('COMMIT')
+    connection.close()
+    return ids
+
+# Claim the pending job with the highest priority, or a running job whose lease
+# expired (its worker crashed). Expired jobs that used all their attempts are marked
+# as failed instead. Returns (id, chain) or None if there are no jobs
+def claim(filepath, worker):
+    connection = connect(filepath)
+    connection.execute('BEGIN IMMEDIATE')
+    now = time.time()
+    connection.execute('''UPDATE jobs SET status='failed', result=?
+                          WHERE status='running' AND lease<? AND attempts>=?''',
+                       ('Lease expired after {} attempts'.format(MAX_ATTEMPTS), now, MAX_ATTEMPTS))
+    job = connection.execute('''SELECT id, spec FROM jobs
+                                WHERE status='pending' OR (status='running' AND lease<?)
+                                ORDER BY priority DESC LIMIT 1''', (now,)).fetchone()
+    if job is not None:
+        connection.execute('''UPDATE jobs SET status='running', worker=?, lease=?, attempts=attempts+1
+                              WHERE id=?''', (worker, now+LEASE_TIME, job[0]))
+    connection.execute('COMMIT')
+    connection.close()
+    return None if job is None else (job[0], pickle.loads(job[1]))
+
+# Renew the lease of a running job
+def renew(filepath, job_id, worker):
+    connection = connect(filepath)
+    connection.execute("UPDATE jobs SET lease=? WHERE id=? AND worker=? AND status='running'",
+                       (time.time()+LEASE_TIME, job_id, worker))
+    connection.close()
+
+# Mark a job as done with its result
+def complete(filepath, job_id, result):
+    connection = connect(filepath)
+    connection.execute("UPDATE jobs SET status='done', result=? WHERE id=?", (json.dumps(result), job_id))
+    connection.close()
+
+# Give back a job that raised an error: it is retried until MAX_ATTEMPTS, then marked as failed
+def fail(filepath, job_id, error):
+    connection = connect(filepath)
+    connection.execute('''UPDATE jobs SET status=CASE WHEN attempts<? THEN 'pending' ELSE 'failed' END, result=?
+                          WHERE id=?''', (MAX_ATTEMPTS, error, job_id))
+    connection.close()
+
+# Renew the lease of a job from a background thread until the event is set
+def keep_lease(filepath, job_id, worker, stop):
+    while not stop.wait(LEASE_TIME/3):
+        renew(filepath, job_id, worker)
+
+# Claim and run jobs with the given function until the queue has no jobs left
+# for idle seconds
+def work(filepath, function, idle=60, poll=10):
+    worker = worker_name()
+    last = time.time()
+    while True:
+        job = claim(filepath, worker)
+        if job is None:
+            if time.time()-last > idle:
+                return
+            time.sleep(poll)
+            continue
+        job_id, chain = job
+
+        stop = threading.Event()
+        thread = threading.Thread(target=keep_lease, args=(filepath, job_id, worker, stop), daemon=True)
+        thread.start()
+        try:
+            result = function(chain)
+        except Exception as e:
+            fail(filepath, job_id, repr(e))
+        else:
+            complete(filepath, job_id, result)
+        finally:
+            stop.set()
+        last = time.time()
+
+# Enqueue chains of simulations and return their results as soon as the workers
+# finish them (like parallel.imap_hybrid), checking the queue every poll seconds
+def imap_queue(filepath, chain_list, times, poll=10):
+    pending = set(enqueue(filepath, chain_list, times))
+    while len(pending) > 0:
+        connection = connect(filepath)
+        jobs = connection.execute('SELECT id, status, result FROM jobs WHERE id IN ({})'.format(','.join('?'*len(pending))),
+                                  tuple(pending)).fetchall()
+        connection.close()
+        for job_id, status, result in jobs:
+            if status == 'done':
+                pending.remove(job_id)
+                yield json.loads(result)
+            elif status == 'failed':
+                raise RuntimeError('Job {} failed: {}'.format(job_id, result))
+        if len(pending) > 0:
+            time.sleep(poll)